@@ -0,0 +1,404 @@
+# Copyright (c) Sunlight Foundation, 2014, under the BSD-3 License.
+
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.utils.timezone import utc
+from opencivicdata.models import (Division,
+                                  Jurisdiction,
+                                  LegislativeSession,
+                                  Organization,
+                                  Post,
+                                  Person,
+                                  Membership,
+                                  Bill,
+                                  BillAction,
+                                  BillSponsorship,
+                                  VoteEvent,
+                                  VoteCount,
+                                  PersonVote,
+                                  Event)
+
+from importlib import import_module
+
+import datetime
+import platform
+import random
+import timeit
+import uuid
+import math
+import re
+
+"""
+An offline benchmark of the API endpoints.
+
+`DatasetGenerator` fills the database with a synthetic, seeded OCD data set
+(the same `scale` and `seed` always give the same rows and ids), and
+`run_benchmark` drives every view in `imago.urls` through the Django test
+client, for a few `fields` sets each, recording latency percentiles, the
+number of queries and the peak memory allocated per request. `compare`
+checks those results against a stored baseline.
+
+See the `benchmark` management command, which does all of this in a
+throwaway test database.
+"""
+
+FIRST_NAMES = ['Alex', 'Sam', 'Jordan', 'Taylor', 'Morgan', 'Casey', 'Jamie',
+               'Robin', 'Avery', 'Quinn', 'Riley', 'Drew', 'Parker', 'Reese']
+LAST_NAMES = ['Smith', 'Johnson', 'Lee', 'Garcia', 'Brown', 'Davis', 'Lopez',
+              'Wilson', 'Clark', 'Lewis', 'Young', 'Walker', 'Hall', 'Allen']
+SUBJECTS = ['Agriculture', 'Education', 'Health', 'Taxation', 'Transportation',
+            'Environment', 'Housing', 'Labor', 'Public Safety', 'Elections']
+WORDS = ['relating', 'to', 'the', 'funding', 'of', 'public', 'schools', 'roads',
+         'water', 'quality', 'state', 'agencies', 'reform', 'act', 'amending']
+ACTIONS = [('Introduced', 'introduction'), ('Referred to committee', 'committee-referral'),
+           ('Passed', 'passage'), ('Signed by governor', 'executive-signature')]
+
+# Absolute slack on latency, so sub-millisecond jitter isn't a regression.
+LATENCY_SLACK = 0.002
+
+# Ids per request to the batch views.
+BATCH_SIZE = 100
+
+
+class DatasetGenerator(object):
+    """
+    Generates `scale` * 5 state jurisdictions, each with a bicameral
+    legislature, districts, legislators, bills (with actions, sponsors and
+    votes) and events.
+    """
+
+    jurisdictions_per_scale = 5
+    seats = 20
+    bill_count = 50
+    vote_count = 20
+    event_count = 5
+
+    def __init__(self, scale=1, seed=0, country='zz'):
+        self.scale = scale
+        self.rng = random.Random(seed)
+        self.country = country
+        self.counts = {}
+
+    def ocd_id(self, ocd_type):
+        return 'ocd-{}/{}'.format(ocd_type, uuid.UUID(int=self.rng.getrandbits(128),
+                                                      version=4))
+
+    def words(self, n):
+        return ' '.join(self.rng.choice(WORDS) for x in range(n)).capitalize()
+
+    def date(self, year):
+        return datetime.date(year, 1, 1) + datetime.timedelta(days=self.rng.randrange(365))
+
+    def create(self, model, objects):
+        model.objects.bulk_create(objects, batch_size=500)
+        self.counts[model.__name__] = self.counts.get(model.__name__, 0) + len(objects)
+        return objects
+
+    def division(self, division_id, name):
+        return Division(id=division_id, name=name,
+                        **Division.subtypes_from_id(division_id)[0])
+
+    def generate(self):
+        """
+        Create the data set, and return the number of rows made per model.
+        """
+        country = 'ocd-division/country:{}'.format(self.country)
+        self.create(Division, [self.division(country, 'Country')])
+
+        parties = self.create(Organization, [
+            Organization(id=self.ocd_id('organization'), name=name,
+                         classification='party')
+            for name in ('Purple Party', 'Orange Party')
+        ])
+
+        for n in range(self.scale * self.jurisdictions_per_scale):
+            self.jurisdiction(country, 'st{}'.format(n), parties)
+        return self.counts
+
+    def jurisdiction(self, country, state, parties):
+        rng = self.rng
+        division = self.create(Division, [
+            self.division('{}/state:{}'.format(country, state), 'State ' + state.upper())
+        ])[0]
+        jurisdiction = self.create(Jurisdiction, [Jurisdiction(
+            id='ocd-jurisdiction/country:{}/state:{}/government'.format(self.country, state),
+            name='{} Government'.format(division.name),
+            url='http://{}.example.com'.format(state),
+            division=division,
+        )])[0]
+        self.create(LegislativeSession, [
+            LegislativeSession(jurisdiction=jurisdiction, identifier=str(year),
+                               name='{} Regular Session'.format(year),
+                               classification='primary',
+                               start_date='{}-01-01'.format(year),
+                               end_date='{}-12-31'.format(year))
+            for year in (2013, 2014)
+        ])
+        # bulk_create doesn't hand back auto ids.
+        sessions = list(jurisdiction.legislative_sessions.order_by('identifier'))
+
+        legislature = self.create(Organization, [Organization(
+            id=self.ocd_id('organization'), name='{} Legislature'.format(division.name),
+            classification='legislature', jurisdiction=jurisdiction,
+        )])[0]
+        chambers = self.create(Organization, [
+            Organization(id=self.ocd_id('organization'), name=name, classification=kind,
+                         parent=legislature, jurisdiction=jurisdiction)
+            for name, kind in (('Senate', 'upper'), ('House', 'lower'))
+        ])
+
+        districts = []
+        posts = []
+        for chamber in chambers:
+            for seat in range(1, self.seats + 1):
+                district = self.division('{}/sld{}:{}'.format(
+                    division.id, chamber.classification[0], seat),
+                    '{} District {}'.format(chamber.name, seat))
+                districts.append(district)
+                posts.append(Post(id=self.ocd_id('post'), label=str(seat),
+                                  role='Senator' if chamber.classification == 'upper'
+                                  else 'Representative',
+                                  organization=chamber, division=district))
+        self.create(Division, districts)
+        self.create(Post, posts)
+
+        people = self.create(Person, [
+            Person(id=self.ocd_id('person'), name='{} {}'.format(first, last),
+                   sort_name='{}, {}'.format(last, first),
+                   gender=rng.choice(['female', 'male', '']),
+                   image='http://{}.example.com/{}.jpg'.format(state, n))
+            for n, (first, last) in enumerate(
+                (rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)) for post in posts)
+        ])
+        memberships = []
+        for person, post in zip(people, posts):
+            memberships.append(Membership(
+                id=self.ocd_id('membership'), organization=post.organization,
+                person=person, post=post, role=post.role, start_date='2013-01-01'))
+            memberships.append(Membership(
+                id=self.ocd_id('membership'), organization=rng.choice(parties),
+                person=person, role='member'))
+        self.create(Membership, memberships)
+
+        self.bills(jurisdiction, sessions, chambers, people)
+
+        self.create(Event, [
+            Event(id=self.ocd_id('event'), name=self.words(4), jurisdiction=jurisdiction,
+                  description=self.words(12), classification='committee-meeting',
+                  start_time=datetime.datetime.combine(
+                      self.date(2014), datetime.time(rng.randrange(8, 18))
+                  ).replace(tzinfo=utc),
+                  timezone='UTC', status='passed')
+            for n in range(self.event_count)
+        ])
+
+    def bills(self, jurisdiction, sessions, chambers, people):
+        rng = self.rng
+        bills = []
+        for n in range(self.bill_count):
+            chamber = rng.choice(chambers)
+            bills.append(Bill(
+                id=self.ocd_id('bill'), legislative_session=rng.choice(sessions),
+                identifier='{}B {}'.format(chamber.classification[0].upper(), n + 1),
+                title='An act ' + self.words(10).lower(), from_organization=chamber,
+                classification=['bill'], subject=rng.sample(SUBJECTS, 2)))
+        self.create(Bill, bills)
+
+        actions = []
+        sponsorships = []
+        for bill in bills:
+            year = int(bill.legislative_session.identifier)
+            for order, (description, classification) in enumerate(
+                    ACTIONS[:rng.randrange(1, len(ACTIONS) + 1)]):
+                actions.append(BillAction(
+                    bill=bill, organization=bill.from_organization, order=order,
+                    description=description, classification=[classification],
+                    date=self.date(year).isoformat()))
+            sponsor = rng.choice(people)
+            sponsorships.append(BillSponsorship(
+                bill=bill, name=sponsor.name, entity_type='person', person=sponsor,
+                primary=True, classification='primary'))
+        self.create(BillAction, actions)
+        self.create(BillSponsorship, sponsorships)
+
+        votes = []
+        counts = []
+        person_votes = []
+        for bill in rng.sample(bills, min(self.vote_count, len(bills))):
+            yes = rng.randrange(len(people) + 1)
+            vote = VoteEvent(
+                id=self.ocd_id('vote'), motion_text='Shall the bill pass?',
+                motion_classification=['passage'], organization=bill.from_organization,
+                legislative_session=bill.legislative_session, bill=bill,
+                start_date=self.date(int(bill.legislative_session.identifier)).isoformat(),
+                result='pass' if yes * 2 > len(people) else 'fail')
+            votes.append(vote)
+            counts.append(VoteCount(vote_event=vote, option='yes', value=yes))
+            counts.append(VoteCount(vote_event=vote, option='no', value=len(people) - yes))
+            for i, person in enumerate(people):
+                person_votes.append(PersonVote(
+                    vote_event=vote, option='yes' if i < yes else 'no',
+                    voter_name=person.name, voter=person))
+        self.create(VoteEvent, votes)
+        self.create(VoteCount, counts)
+        self.create(PersonVote, person_votes)
+
+
+def discover_endpoints(urlconf='imago.urls'):
+    """
+    Return (name, view class, path template) for every API view in
+    `urlconf`. Detail templates have a `{pk}` placeholder; detail views
+    routed without one are batch views, named "<model>Batch".
+    """
+    endpoints = []
+    for pattern in import_module(urlconf).urlpatterns:
+        view = getattr(import_module(pattern.callback.__module__), pattern.callback.__name__)
+        if getattr(view, 'model', None) is None:
+            continue
+        path = re.sub(r'\(\?P<pk>[^)]*\)', '{pk}', pattern.regex.pattern)
+        name = view.__name__
+        if name.endswith('Detail') and '{pk}' not in path:
+            name = name[:-len('Detail')] + 'Batch'
+        endpoints.append((name, view, '/' + path.strip('^$')))
+    return endpoints
+
+
+def field_sets(view, views):
+    """
+    The `fields` to request from a view: its defaults, just the ids, and
+    for list views, everything the matching detail view returns.
+    """
+    sets = [('default', None), ('id', ['id'])]
+    if view.__name__.endswith('List'):
+        for other in views:
+            if other.model is view.model and other.__name__.endswith('Detail'):
+                sets.append(('detail', list(other.default_fields)))
+    return sets
+
+
+def percentile(values, p):
+    """
+    Nearest-rank percentile of a sorted list.
+    """
+    rank = int(math.ceil(p / 100.0 * len(values)))
+    return values[max(rank, 1) - 1]
+
+
+def measure(client, path, params, requests, warmup):
+    """
+    Request `path` `warmup` + `requests` times, and return the latency
+    percentiles (in seconds) of the last `requests`, plus the query count
+    and peak memory (in bytes) of one more, separately traced, request.
+    """
+    try:
+        import tracemalloc
+    except ImportError:
+        tracemalloc = None
+
+    for x in range(warmup):
+        client.get(path, params)
+
+    times = []
+    for x in range(requests):
+        start = timeit.default_timer()
+        response = client.get(path, params)
+        times.append(timeit.default_timer() - start)
+    times.sort()
+
+    with CaptureQueriesContext(connection) as queries:
+        if tracemalloc is not None:
+            tracemalloc.start()
+        try:
+            client.get(path, params)
+            peak = tracemalloc.get_traced_memory()[1] if tracemalloc else None
+        finally:
+            if tracemalloc is not None:
+                tracemalloc.stop()
+
+    return {
+        "status": response.status_code,
+        "p50": percentile(times, 50),
+        "p95": percentile(times, 95),
+        "p99": percentile(times, 99),
+        "mean": sum(times) / len(times),
+        "queries": len(queries),
+        "peak_memory": peak,
+    }
+
+
+def run_benchmark(requests=20, warmup=2, params=None, urlconf='imago.urls', log=None):
+    """
+    Benchmark every endpoint in `urlconf` and field set, returning a dict of
+    results keyed by "<view name>:<field set>". Detail views are requested
+    for the first object (by id) of their model, and batch views for the
+    first `BATCH_SIZE`.
+    """
+    client = Client()
+    endpoints = discover_endpoints(urlconf)
+    views = [view for name, view, path in endpoints]
+    results = {}
+
+    for name, view, path in endpoints:
+        if '{pk}' in path:
+            obj = view.model.objects.order_by('pk').only('pk').first()
+            if obj is None:
+                continue
+            path = path.format(pk=obj.pk)
+
+        batch = None
+        if name.endswith('Batch'):
+            batch = ','.join(view.model.objects.order_by('pk').values_list(
+                'pk', flat=True)[:BATCH_SIZE])
+            if not batch:
+                continue
+
+        for label, fields in field_sets(view, views):
+            query = dict(params or {})
+            if batch is not None:
+                query['id'] = batch
+            if fields is not None:
+                query['fields'] = ','.join(fields)
+            key = '{}:{}'.format(name, label)
+            results[key] = dict(measure(client, path, query, requests, warmup), path=path)
+            if log:
+                log(key, results[key])
+
+    return results
+
+
+def environment():
+    import django
+    from . import __version__
+    return {
+        "imago": __version__,
+        "django": django.get_version(),
+        "python": platform.python_version(),
+        "vendor": connection.vendor,
+    }
+
+
+def compare(results, baseline, tolerance=0.25):
+    """
+    Return a list of regressions of `results` against `baseline`: any rise
+    in query count or a failing status, or a p95 latency or peak memory
+    more than `tolerance` (a fraction) above the baseline. Endpoints missing
+    from either side are skipped.
+    """
+    regressions = []
+    for key in sorted(set(results) & set(baseline)):
+        now, then = results[key], baseline[key]
+        if now['status'] != then['status']:
+            regressions.append('{}: status {} (was {})'.format(
+                key, now['status'], then['status']))
+        if now['queries'] > then['queries']:
+            regressions.append('{}: {} queries (was {})'.format(
+                key, now['queries'], then['queries']))
+        if now['p95'] > then['p95'] * (1 + tolerance) + LATENCY_SLACK:
+            regressions.append('{}: p95 {:.4f}s (was {:.4f}s)'.format(
+                key, now['p95'], then['p95']))
+        if (now['peak_memory'] is not None and then['peak_memory'] is not None and
+                now['peak_memory'] > then['peak_memory'] * (1 + tolerance)):
+            regressions.append('{}: peak memory {} bytes (was {})'.format(
+                key, now['peak_memory'], then['peak_memory']))
+    return regressions
@@ -1,5 +1,13 @@
+from concurrent.futures import ThreadPoolExecutor
+from collections import defaultdict
+from urllib.parse import urljoin, urlsplit
+import threading
+import argparse
 import requests
+import math
+import time
 import sys
+import re
 
 
 def debug():
@@ -45,6 +53,9 @@ def benchmark(url, **kwargs):
     print("Prefetched Fields:")
     for field in debug['prefetch_fields']:
         print("  %s" % (field))
+    print("Joined (select_related) Fields:")
+    for field in debug.get('select_related_fields', []):
+        print("  %s" % (field))
     for x in range(count):
         time = requests.get(url, params=kwargs).json().get(
             "debug")['time']['seconds']
@@ -55,3 +66,158 @@ def benchmark(url, **kwargs):
     print("")
     print("Total time (s):  %s" % (total_time))
     print("Per request (s)  %s" % (total_time / count))
+
+
+DEFAULT_PATHS = ['/jurisdictions/', '/people/', '/organizations/', '/bills/',
+                 '/votes/', '/events/', '/divisions/']
+
+# Request lines in Common / Combined Log Format, which is also what nginx,
+# Apache and `manage.py runserver` write.
+LOG_REQUEST = re.compile(r'"GET (\S+) HTTP/[\d.]+"')
+
+# Upper bounds (ms) of the latency histogram buckets.
+BUCKETS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, float('inf')]
+
+
+def load():
+    parser = argparse.ArgumentParser(
+        description="Put concurrent load on an imago server, and report "
+                    "client side latency, throughput and errors.")
+    parser.add_argument('url', help="base URL of the API, e.g. http://localhost:8000/")
+    parser.add_argument('paths', nargs='*',
+                        help="paths to request, in turn (default: the list endpoints)")
+    parser.add_argument('--log', help="replay the GET requests in this access log")
+    parser.add_argument('-c', '--concurrency', type=int, default=8,
+                        help="number of concurrent workers (default: 8)")
+    parser.add_argument('-n', '--requests', type=int, default=200,
+                        help="total number of requests (default: 200)")
+    parser.add_argument('--rate', type=float, default=0,
+                        help="target requests per second across all workers "
+                             "(default: as fast as possible)")
+    parser.add_argument('--timeout', type=float, default=30,
+                        help="per request timeout in seconds (default: 30)")
+    parser.add_argument('--apikey', help="API key to send with every request")
+    args = parser.parse_args()
+    if args.requests < 1 or args.concurrency < 1:
+        parser.error("--requests and --concurrency must be at least 1")
+
+    if args.log:
+        with open(args.log) as f:
+            paths = read_access_log(f)
+        if not paths:
+            parser.error("no GET requests found in %s" % (args.log))
+    else:
+        paths = args.paths or DEFAULT_PATHS
+
+    params = {'apikey': args.apikey} if args.apikey else {}
+    results, elapsed = run_load(args.url, paths, args.requests, args.concurrency,
+                                args.rate, args.timeout, params)
+    report(results, elapsed)
+
+
+def read_access_log(lines):
+    """
+    Return the paths (with query strings) of the GET requests in an
+    access log, in order.
+    """
+    paths = []
+    for line in lines:
+        match = LOG_REQUEST.search(line)
+        if match:
+            paths.append(match.group(1))
+    return paths
+
+
+def endpoint_for(path):
+    """
+    Group a request path by endpoint: the query string is dropped, and
+    detail views collapse to their OCD type (/ocd-person/*/).
+    """
+    path = urlsplit(path).path
+    match = re.search(r'/(ocd-[a-z]+)/', path)
+    if match:
+        return '/%s/*/' % (match.group(1))
+    return path
+
+
+def run_load(base, paths, total, concurrency, rate, timeout, params):
+    """
+    Request `total` URLs, cycling through `paths`, from `concurrency`
+    threads. With a `rate`, request i is due at start + i / rate, and its
+    latency is measured from then rather than from when it was sent, so
+    a server falling behind shows up as latency instead of silently
+    lowering the rate.
+
+    Returns a list of (endpoint, status or None, seconds) and the elapsed
+    wall clock time.
+    """
+    local = threading.local()
+    start = time.time()
+
+    def fetch(i):
+        session = getattr(local, 'session', None)
+        if session is None:
+            session = local.session = requests.Session()
+
+        path = paths[i % len(paths)]
+        due = start + i / rate if rate else time.time()
+        delay = due - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        began = due if rate else time.time()
+
+        try:
+            status = session.get(urljoin(base, path), params=params,
+                                 timeout=timeout).status_code
+        except requests.RequestException:
+            status = None
+        return endpoint_for(path), status, time.time() - began
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(fetch, range(total)))
+    return results, time.time() - start
+
+
+def percentile(values, p):
+    """ nearest-rank percentile of a sorted list """
+    return values[max(int(math.ceil(p / 100.0 * len(values))), 1) - 1]
+
+
+def report(results, elapsed):
+    times = sorted(seconds for endpoint, status, seconds in results)
+    errors = [status for endpoint, status, seconds in results
+              if status is None or status >= 400]
+
+    print("")
+    print("Requests:        %s in %.2fs" % (len(results), elapsed))
+    print("Throughput:      %.1f req/s" % (len(results) / elapsed))
+    print("Errors:          %s (%.1f%%)" % (len(errors), 100.0 * len(errors) / len(results)))
+    for status in sorted(set(errors), key=str):
+        print("  %s:  %s" % (status or "connection error", errors.count(status)))
+    print("Latency (ms):    p50 %.1f  p90 %.1f  p99 %.1f  max %.1f" % tuple(
+        1000 * x for x in (percentile(times, 50), percentile(times, 90),
+                           percentile(times, 99), times[-1])))
+    print("")
+
+    print("Histogram:")
+    counts = [0] * len(BUCKETS)
+    for seconds in times:
+        counts[next(i for i, bound in enumerate(BUCKETS) if seconds * 1000 <= bound)] += 1
+    widest = max(counts)
+    for bound, count in zip(BUCKETS, counts):
+        label = "<= %sms" % (bound) if bound != float('inf') else "> %sms" % (BUCKETS[-2])
+        print("  %10s  %6s  %s" % (label, count, "#" * int(50 * count / widest)))
+    print("")
+
+    by_endpoint = defaultdict(list)
+    for endpoint, status, seconds in results:
+        by_endpoint[endpoint].append((status, seconds))
+
+    print("%-32s %7s %7s %9s %9s %9s" % ("Endpoint", "Count", "Errors",
+                                         "p50 (ms)", "p95 (ms)", "max (ms)"))
+    for endpoint, items in sorted(by_endpoint.items()):
+        seconds = sorted(x[1] for x in items)
+        failed = sum(1 for status, x in items if status is None or status >= 400)
+        print("%-32s %7s %7s %9.1f %9.1f %9.1f" % (
+            endpoint, len(items), failed, 1000 * percentile(seconds, 50),
+            1000 * percentile(seconds, 95), 1000 * seconds[-1]))
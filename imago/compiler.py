@@ -0,0 +1,302 @@
+# Copyright (c) Sunlight Foundation, 2014, under the BSD-3 License.
+
+from django.db.models import Model, Manager
+from restless.models import serialize
+
+from .serialize import dout
+
+import datetime
+import decimal
+import keyword
+import uuid
+
+"""
+This module turns a serialize spec (as returned by `imago.helpers.get_fields`)
+into a specialized Python function.
+
+`restless.models.serialize` interprets the nested {"fields": [...]} spec
+generically for every object it's handed. For a 100 row page with fields
+like `memberships.organization.jurisdiction.id` that's a lot of dispatch
+that never changes between rows, so instead we generate (once per spec)
+the code we'd have written by hand: direct attribute access, inlined
+`lambda x: x.extras` / `lambda x: dout(x.created_at)` helpers, and list
+comprehensions over the (prefetched) related managers.
+
+The output is exactly what `restless.models.serialize` would produce. Any
+part of a spec the compiler doesn't understand is handed off to restless
+as-is, as are any values that aren't plain scalars.
+
+The generated functions also take a `memo` dict, which callers share over
+a page of objects. Each model instance is only serialized once per part of
+the spec, keyed by (part, model, pk): the legislature embedded under every
+person's memberships is built the first time, and the same dict is reused
+after that. `reference_repeated` can then pull those shared dicts out into
+an `included` section.
+"""
+
+# Types that `restless.models.serialize` hands back untouched.
+SCALAR_TYPES = frozenset([
+    str, bytes, int, float, bool, type(None),
+    datetime.datetime, datetime.date, datetime.time,
+    decimal.Decimal, uuid.UUID,
+])
+
+
+def _template_code(source):
+    return eval(source, {'dout': dout}).__code__
+
+
+def _code_matches(code, template):
+    return (code.co_code == template.co_code and
+            code.co_names == template.co_names and
+            code.co_consts == template.co_consts)
+
+
+def _inline_callable(fn, arg):
+    """
+    Return a Python expression equivalent to calling `fn(arg)` if `fn` is
+    one of the trivial lambdas used throughout imago.serialize, otherwise
+    None.
+    """
+    shape = _callable_shape(fn)
+    if shape is None:
+        return None
+    wrapper, attr = shape
+    if wrapper is None:
+        return "%s.%s" % (arg, attr)
+    return "_dout(%s.%s)" % (arg, attr)
+
+
+def _callable_shape(fn):
+    code = getattr(fn, '__code__', None)
+    if code is None or code.co_argcount != 1 or fn.__closure__:
+        return None
+
+    names = code.co_names
+    if len(names) == 1 and _is_identifier(names[0]):
+        if _code_matches(code, _template_code("lambda x: x.%s" % (names[0]))):
+            return (None, names[0])
+
+    if (len(names) == 2 and names[0] == 'dout' and _is_identifier(names[1])
+            and fn.__globals__.get('dout') is dout):
+        template = _template_code("lambda x: dout(x.%s)" % (names[1]))
+        if _code_matches(code, template):
+            return ('dout', names[1])
+
+    return None
+
+
+def callable_attribute(fn):
+    """
+    Return the name of the one attribute `fn` reads off the object it's
+    given, if it's one of the trivial lambdas we know how to inline.
+    Otherwise we can't tell what it needs, and this returns None.
+    """
+    shape = _callable_shape(fn)
+    return None if shape is None else shape[1]
+
+
+def _is_identifier(name):
+    return name.isidentifier() and not keyword.iskeyword(name)
+
+
+def is_compilable(spec):
+    """
+    Only specs that are exactly {"fields": [(name, callable-or-dict), ...]}
+    are compiled, everything else goes through restless.
+    """
+    if not isinstance(spec, dict) or list(spec.keys()) != ['fields']:
+        return False
+    fields = spec['fields']
+    if not isinstance(fields, (list, tuple)):
+        return False
+    return all(isinstance(x, tuple) and len(x) == 2 and isinstance(x[0], str)
+               for x in fields)
+
+
+class SerializerCompiler(object):
+    """
+    Generate the source for a serialize spec. Each spec dict becomes a
+    `_node_N` function (dispatching on what the attribute holds, just like
+    restless does) and a `_model_N` function that builds the dict for one
+    model instance.
+    """
+
+    def __init__(self):
+        self.lines = []
+        self.namespace = {
+            '_Model': Model,
+            '_Manager': Manager,
+            '_SCALAR_TYPES': SCALAR_TYPES,
+            '_serialize': serialize,
+            '_dout': dout,
+        }
+        self.nodes = {}
+        self.counter = 0
+
+    def name(self, prefix, obj=None):
+        self.counter += 1
+        name = "%s_%s" % (prefix, self.counter)
+        if obj is not None:
+            self.namespace[name] = obj
+        return name
+
+    def node(self, spec):
+        """
+        Emit the function serializing whatever an attribute with `spec`
+        holds, and return its name.
+        """
+        key = id(spec)
+        if key in self.nodes:
+            return self.nodes[key]
+
+        if not is_compilable(spec):
+            name = self.name('_spec', spec)
+            self.nodes[key] = "_node%s" % (name)
+            self.lines.extend([
+                "def _node%s(src, memo):" % (name),
+                "    return _serialize(src, **%s)" % (name),
+                "",
+            ])
+            return self.nodes[key]
+
+        model = self.model(spec)
+        name = model.replace("_model", "_node", 1)
+        self.nodes[key] = name
+        self.lines.extend([
+            "def %s(src, memo):" % (name),
+            "    if isinstance(src, _Manager):",
+            "        return [%s(x, memo) for x in src.all()]" % (model),
+            "    if isinstance(src, _Model):",
+            "        return %s(src, memo)" % (model),
+            "    if src is None:",
+            "        return None",
+            "    return _serialize(src, **%s)" % (self.name('_spec', spec)),
+            "",
+        ])
+        return name
+
+    def model(self, spec):
+        name = self.name('_model')
+        body = []
+        items = []
+
+        for key, value in spec['fields']:
+            if callable(value):
+                expr = _inline_callable(value, "obj")
+                if expr is None:
+                    expr = "%s(obj)" % (self.name('_call', value))
+                items.append((key, expr))
+                continue
+
+            if not isinstance(value, dict):
+                # restless silently skips these.
+                continue
+
+            if _is_identifier(key):
+                getter = "obj.%s" % (key)
+            else:
+                getter = "getattr(obj, %r)" % (key)
+
+            var = "v%s" % (len(body))
+            body.append("    %s = %s" % (var, getter))
+
+            if value == {}:
+                items.append((key, "%s if %s.__class__ in _SCALAR_TYPES else "
+                                   "_serialize(%s)" % (var, var, var)))
+            else:
+                items.append((key, "%s(%s, memo)" % (self.node(value), var)))
+
+        self.lines.append("def %s(obj, memo):" % (name))
+        self.lines.append("    key = (%d, obj.__class__, obj.pk)" % (self.counter))
+        self.lines.append("    done = memo.get(key)")
+        self.lines.append("    if done is not None:")
+        self.lines.append("        return done")
+        self.lines.extend(body)
+        self.lines.append("    done = memo[key] = {")
+        for key, expr in items:
+            self.lines.append("        %r: %s," % (key, expr))
+        self.lines.append("    }")
+        self.lines.append("    return done")
+        self.lines.append("")
+        return name
+
+    def compile(self, spec):
+        root = self.node(spec)
+        self.lines.extend([
+            "def _serialize_root(src, memo=None):",
+            "    return %s(src, {} if memo is None else memo)" % (root),
+            "",
+        ])
+        source = "\n".join(self.lines)
+        exec(compile(source, "<imago.compiler>", "exec"), self.namespace)
+        fn = self.namespace['_serialize_root']
+        fn.source = source
+        return fn
+
+
+def compile_serializer(spec):
+    """
+    Return a function that takes a model instance (or a related manager,
+    or None), and optionally a memo dict to share between calls, and
+    returns the same thing as `serialize(obj, **spec)`.
+    """
+    return SerializerCompiler().compile(spec)
+
+
+def reference_repeated(results, memo):
+    """
+    Replace the model dicts that occur more than once in `results` (as
+    shared through `memo`) with {"ref": pk}, in place, and return them as
+    {pk: dict}, with the pks as strings. An object serialized with more
+    than one part of the spec is only referenced for the first; the others
+    stay inline.
+    """
+    pks = dict((id(value), key[2]) for key, value in memo.items())
+    counts = {}
+    order = []
+    seen = set()
+
+    def count(node):
+        if isinstance(node, dict):
+            if id(node) in pks:
+                counts[id(node)] = counts.get(id(node), 0) + 1
+            if id(node) in seen:
+                return
+            seen.add(id(node))
+            order.append(node)
+            values = node.values()
+        elif isinstance(node, list):
+            values = node
+        else:
+            return
+        for value in values:
+            count(value)
+
+    count(results)
+
+    included, refs = {}, {}
+    for value in order:
+        pk = str(pks.get(id(value)))
+        if counts.get(id(value), 0) > 1 and pk not in included:
+            included[pk] = value
+            refs[id(value)] = {"ref": pk}
+
+    seen = set()
+
+    def replace(node):
+        if id(node) in seen:
+            return
+        seen.add(id(node))
+        if isinstance(node, dict):
+            items = list(node.items())
+        else:
+            items = list(enumerate(node))
+        for key, value in items:
+            if isinstance(value, (dict, list)):
+                replace(value)
+                if id(value) in refs:
+                    node[key] = refs[id(value)]
+
+    replace(results)
+    return included
@@ -0,0 +1,175 @@
+# Copyright (c) Sunlight Foundation, 2014, under the BSD-3 License.
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
+
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+"""
+Response compression for the API views.
+
+The encoding is negotiated from `Accept-Encoding`: brotli if the `brotli`
+package is installed and the client takes it, otherwise gzip. Streamed
+responses (`format=ndjson` exports) are compressed chunk by chunk, flushing
+after each so rows still arrive as they're read.
+
+With `IMAGO_COMPRESSION_CACHE` set to the name of a Django cache, the
+compressed bytes of responses carrying an ETag are kept there, keyed by
+ETag and encoding. Since the ETag already pins down the exact content, a
+view that finds its ETag cached returns those bytes right away, skipping
+the serialization as well as the compression.
+
+Compressed responses get a weak ETag (`W/"..."`), since the bytes differ
+from the uncompressed representation; `If-None-Match` still matches it.
+"""
+
+COMPRESSIBLE_TYPES = ('application/json', 'application/x-ndjson')
+
+
+def choose_encoding(accept_encoding):
+    """
+    Pick the content coding to use from an `Accept-Encoding` header, or
+    None to send the body as it is.
+    """
+    accepted = {}
+    for part in accept_encoding.split(','):
+        coding, _, params = part.partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params.split(';'):
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[coding] = q
+
+    available = ('br', 'gzip') if brotli is not None else ('gzip',)
+    for coding in available:
+        if accepted.get(coding, accepted.get('*', 0.0)) > 0:
+            return coding
+    return None
+
+
+def compress(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=getattr(settings, 'IMAGO_BROTLI_QUALITY', 5))
+    # wbits=31 writes a gzip header (with a zeroed mtime, so the output is
+    # the same every time).
+    compressor = zlib.compressobj(getattr(settings, 'IMAGO_GZIP_LEVEL', 6),
+                                  zlib.DEFLATED, 31)
+    return compressor.compress(data) + compressor.flush()
+
+
+def compress_stream(chunks, encoding):
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=getattr(settings, 'IMAGO_BROTLI_QUALITY', 5))
+        for chunk in chunks:
+            yield compressor.process(chunk) + compressor.flush()
+        yield compressor.finish()
+        return
+
+    compressor = zlib.compressobj(getattr(settings, 'IMAGO_GZIP_LEVEL', 6),
+                                  zlib.DEFLATED, 31)
+    for chunk in chunks:
+        yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
+
+
+def weak_etag(etag):
+    return etag if etag.startswith('W/') else 'W/' + etag
+
+
+def compressed_cache():
+    name = getattr(settings, 'IMAGO_COMPRESSION_CACHE', None)
+    return caches[name] if name else None
+
+
+def cache_key(etag, encoding):
+    return "imago:compressed:%s:%s" % (encoding, etag.replace('W/', '').strip('"'))
+
+
+class CompressionMixin(object):
+    """
+    Compresses the view's responses, when `IMAGO_COMPRESSION` is on. This
+    has to come before the restless endpoint in the bases (and after
+    `TimingMixin`, so compression gets timed).
+    """
+
+    def compression_enabled(self):
+        return getattr(settings, 'IMAGO_COMPRESSION', True)
+
+    def negotiate_encoding(self, request):
+        if not self.compression_enabled():
+            return None
+        return choose_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+
+    def cached_response(self, request, etag, last_modified):
+        """
+        The cached compressed response for `etag`, in the encoding the
+        client wants, or None. Views call this once they know the ETag.
+        """
+        cache = compressed_cache()
+        encoding = self.negotiate_encoding(request)
+        if cache is None or encoding is None or etag is None or settings.DEBUG:
+            return None
+
+        content = cache.get(cache_key(etag, encoding))
+        if content is None:
+            return None
+
+        response = HttpResponse(content, content_type='application/json; charset=utf-8')
+        response['Content-Encoding'] = encoding
+        response['Content-Length'] = str(len(content))
+        self.set_validators(response, weak_etag(etag), last_modified)
+        response['Access-Control-Allow-Origin'] = "*"
+        return response
+
+    def dispatch(self, request, *args, **kwargs):
+        response = super(CompressionMixin, self).dispatch(request, *args, **kwargs)
+        if not self.compression_enabled():
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encoding = self.negotiate_encoding(request)
+        if encoding is None or response.has_header('Content-Encoding'):
+            return response
+
+        if response.status_code == 304 and response.has_header('ETag'):
+            response['ETag'] = weak_etag(response['ETag'])
+        if (response.status_code != 200 or
+                not response.get('Content-Type', '').startswith(COMPRESSIBLE_TYPES)):
+            return response
+
+        with self.phase('compress'):
+            if response.streaming:
+                response.streaming_content = compress_stream(response.streaming_content,
+                                                             encoding)
+                if response.has_header('Content-Length'):
+                    del response['Content-Length']
+            else:
+                if len(response.content) < getattr(settings, 'IMAGO_COMPRESSION_MIN_SIZE',
+                                                   1024):
+                    return response
+                response.content = compress(response.content, encoding)
+                response['Content-Length'] = str(len(response.content))
+                cache = compressed_cache()
+                if (cache is not None and response.has_header('ETag') and
+                        not settings.DEBUG):
+                    cache.set(cache_key(response['ETag'], encoding), response.content,
+                              getattr(settings, 'IMAGO_COMPRESSION_CACHE_TTL', 3600))
+
+            response['Content-Encoding'] = encoding
+            if response.has_header('ETag'):
+                response['ETag'] = weak_etag(response['ETag'])
+        return response
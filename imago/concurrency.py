@@ -0,0 +1,147 @@
+# Copyright (c) Sunlight Foundation, 2014, under the BSD-3 License.
+
+from django.conf import settings
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import close_old_connections
+from django.db.models.query import prefetch_related_objects
+from django.db.models import Prefetch
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+
+import threading
+
+"""
+Opt-in concurrent queries for the API views.
+
+With `IMAGO_CONCURRENT_QUERIES` on, list views run the `COUNT` on another
+database connection while they fetch the page, and the prefetches are run
+a level at a time, with the lookups of each level (`memberships__post`
+and `memberships__organization`, say) running side by side. A request then
+takes about as long as its slowest chain of queries, rather than the sum
+of all of them.
+
+The queries run on a pool of `IMAGO_QUERY_WORKERS` threads (default 4),
+each with its own connection, so:
+
+    - set `CONN_MAX_AGE`, or every query on a worker pays for a new
+      connection;
+    - the database has to take `IMAGO_QUERY_WORKERS` more connections per
+      process;
+    - the workers can't see uncommitted data, so this doesn't work inside
+      a transaction (`ATOMIC_REQUESTS`, or Django's `TestCase`);
+    - queries on the workers aren't in the `debug` block or the query
+      checks (see imago.queries).
+"""
+
+_pool = None
+_lock = threading.Lock()
+
+
+def concurrent_queries_enabled():
+    return getattr(settings, 'IMAGO_CONCURRENT_QUERIES', False)
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _lock:
+            if _pool is None:
+                _pool = ThreadPoolExecutor(
+                    max_workers=getattr(settings, 'IMAGO_QUERY_WORKERS', 4))
+    return _pool
+
+
+def _run(fn, args):
+    try:
+        return fn(*args)
+    finally:
+        # What the request_finished signal does for request threads.
+        close_old_connections()
+
+
+def submit_query(fn, *args):
+    """
+    Run `fn(*args)` on a worker, returning the future.
+    """
+    return get_pool().submit(_run, fn, args)
+
+
+def prefetch_levels(lookups):
+    """
+    Group prefetch lookups by depth, shallowest first. Any missing
+    intermediate paths are added, so no two lookups of a level fetch the
+    same relation.
+    """
+    paths = OrderedDict()
+    for lookup in lookups:
+        path = lookup.prefetch_to if isinstance(lookup, Prefetch) else lookup
+        hops = path.split('__')
+        for i in range(1, len(hops)):
+            paths.setdefault('__'.join(hops[:i]), '__'.join(hops[:i]))
+        paths[path] = lookup
+
+    levels = []
+    for path, lookup in paths.items():
+        depth = path.count('__')
+        while len(levels) <= depth:
+            levels.append([])
+        levels[depth].append(lookup)
+    return levels
+
+
+def related_objects(objects, attr):
+    """
+    The objects `attr` leads to from `objects`, where it's been prefetched
+    (or cached, for a single related object).
+    """
+    related = []
+    for obj in objects:
+        cache = getattr(obj, '_prefetched_objects_cache', {})
+        if attr in cache:
+            related.extend(cache[attr])
+            continue
+        try:
+            value = getattr(obj, attr)
+        except ObjectDoesNotExist:
+            continue
+        if value is not None:
+            related.append(value)
+    return related
+
+
+def prefetch_concurrently(objects, lookups):
+    """
+    `prefetch_related_objects`, running the lookups of each level at the
+    same time: one on this thread, the others on workers.
+
+    Each lookup only goes one step, from the objects its parent lookup
+    fetched, so nothing is fetched twice and no two threads write to the
+    same cache. The caches are set up here before the workers start, as
+    Django would otherwise create them on whichever thread gets there first.
+    """
+    fetched = {'': objects}
+    for level in prefetch_levels(lookups):
+        steps = []
+        for lookup in level:
+            path = lookup.prefetch_to if isinstance(lookup, Prefetch) else lookup
+            parent, _, attr = path.rpartition('__')
+            if isinstance(lookup, Prefetch):
+                step = Prefetch(attr, queryset=lookup.queryset)
+            else:
+                step = attr
+            for obj in fetched[parent]:
+                if not hasattr(obj, '_prefetched_objects_cache'):
+                    obj._prefetched_objects_cache = {}
+            steps.append((path, parent, attr, step))
+
+        futures = [submit_query(prefetch_related_objects, fetched[parent], [step])
+                   for _, parent, _, step in steps[1:]]
+        try:
+            _, parent, _, step = steps[0]
+            prefetch_related_objects(fetched[parent], [step])
+        finally:
+            for future in futures:
+                future.result()
+
+        for path, parent, attr, _ in steps:
+            fetched[path] = related_objects(fetched[parent], attr)
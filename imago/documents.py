@@ -0,0 +1,135 @@
+# Copyright (c) Sunlight Foundation, 2014, under the BSD-3 License.
+
+from django.conf import settings
+from django.db import connection, transaction
+from concurrent.futures import ThreadPoolExecutor
+
+from . import __version__
+from .models import SerializedDocument
+from .renderers import render
+
+import hashlib
+
+"""
+The document store: detail views' rendered JSON, built ahead of time.
+
+Detail responses are by far the most expensive to serialize, yet they only
+change when an import runs. With `IMAGO_DOCUMENT_STORE` on, views with
+`document_store = True` look the object up in `SerializedDocument` by id
+and field spec, and send the stored bytes as they are if the document was
+built from the object's current `updated_at`. Otherwise (the object
+changed, or nobody built that spec) the response is serialized live, as
+usual.
+
+`python manage.py builddocuments` (re)builds the stale and missing
+documents, in batches on a pool of threads. Responses in `DEBUG` mode carry
+a debug block, so they never come from the store.
+"""
+
+
+def document_store_enabled():
+    return getattr(settings, 'IMAGO_DOCUMENT_STORE', False) and not settings.DEBUG
+
+
+def spec_key(view, spec):
+    """
+    The key of `spec` on the `view` class. The imago version is mixed in,
+    so a deploy changing the output leaves the old documents unused.
+    """
+    key = repr((__version__, view.__module__, view.__name__, tuple(spec.fields)))
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def get_document(view, spec, pk, updated_at):
+    """
+    The stored JSON bytes for object `pk`, if they were built from
+    `updated_at`, or None.
+    """
+    try:
+        content = SerializedDocument.objects.filter(
+            object_id=pk, spec=spec_key(view, spec), updated_at=updated_at,
+        ).values_list('content', flat=True).get()
+    except SerializedDocument.DoesNotExist:
+        return None
+    return content.encode('utf-8')
+
+
+def render_document(spec, obj):
+    """
+    `obj` rendered exactly as the detail view would send it.
+    """
+    serialized = spec.serialize(obj)
+    serialized['debug'] = None
+    return render(serialized).decode('utf-8')
+
+
+def stale_ids(view, spec):
+    """
+    The ids of the view's objects with no document for `spec`, or one built
+    from an older version of the object.
+    """
+    built = dict(SerializedDocument.objects.filter(spec=spec_key(view, spec)).values_list(
+        'object_id', 'updated_at'))
+    return [pk for pk, updated_at in view.model.objects.order_by('pk').values_list(
+        'pk', 'updated_at') if built.get(pk) != updated_at]
+
+
+def build_batch(view, spec, ids):
+    """
+    Render and store the documents for the objects in `ids`, returning how
+    many were stored. Runs on its own thread (and database connection).
+    """
+    key = spec_key(view, spec)
+    try:
+        objects = list(spec.apply(view.model.objects.all(), prefetch=False).filter(
+            pk__in=ids))
+        spec.prefetch_objects(objects)
+        spec.preload(objects)
+        documents = [SerializedDocument(view=view.__name__, object_id=x.pk, spec=key,
+                                        updated_at=x.updated_at,
+                                        content=render_document(spec, x))
+                     for x in objects]
+        with transaction.atomic():
+            SerializedDocument.objects.filter(spec=key, object_id__in=ids).delete()
+            SerializedDocument.objects.bulk_create(documents)
+        return len(documents)
+    finally:
+        connection.close()
+
+
+def build_documents(view, spec, batch_size=200, workers=4, rebuild=False, log=None):
+    """
+    Build the view's documents for `spec` (all of them with `rebuild`, or
+    just the stale ones), `batch_size` objects at a time on `workers`
+    threads. Documents of objects that are gone are deleted. Returns the
+    number of documents built.
+    """
+    key = spec_key(view, spec)
+    if rebuild:
+        ids = list(view.model.objects.order_by('pk').values_list('pk', flat=True))
+    else:
+        ids = stale_ids(view, spec)
+
+    built = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        batches = [ids[i:i + batch_size] for i in range(0, len(ids), batch_size)]
+        for count in pool.map(lambda batch: build_batch(view, spec, batch), batches):
+            built += count
+            if log:
+                log(view, built, len(ids))
+
+    SerializedDocument.objects.filter(spec=key).exclude(
+        object_id__in=view.model.objects.values('pk')).delete()
+    return built
+
+
+def prune_documents(view, specs):
+    """
+    Delete the view's documents for any spec but `specs`, such as those
+    built by an older imago version. Returns the number deleted.
+    """
+    keys = [spec_key(view, x) for x in specs]
+    documents = SerializedDocument.objects.filter(view=view.__name__).exclude(spec__in=keys)
+    count = documents.count()
+    documents.delete()
+    return count
@@ -5,14 +5,39 @@
 
 from django.core.paginator import Paginator, EmptyPage
 from django.core.exceptions import FieldError, ObjectDoesNotExist
+from django.db.models import Q, Max, Count, Prefetch
+from django.db.models.query import prefetch_related_objects
+from django.db.models.fields import FieldDoesNotExist
+from django.db.models.sql.datastructures import EmptyResultSet
 from restless.modelviews import ListEndpoint, DetailEndpoint
 from restless.models import serialize
-from restless.http import HttpError, Http200
-from collections import defaultdict
+from restless.http import HttpError
+from collections import defaultdict, OrderedDict
 from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse, StreamingHttpResponse, HttpResponseNotModified
+from django.utils.http import http_date, parse_http_date_safe, parse_etags, quote_etag
 from django.db import connections
 
+from . import __version__
+from .compiler import (compile_serializer, callable_attribute, is_compilable,
+                       reference_repeated)
+from .serialize import BatchedField
+from .timing import TimingMixin
+from .queries import QueryBudgetMixin, group_queries, repeated_queries
+from .metrics import MetricsMixin
+from .renderers import JSONResponse, render, CONTENT_TYPE
+from .compression import CompressionMixin
+from .search import get_search_backend
+from .documents import document_store_enabled, get_document
+from .concurrency import concurrent_queries_enabled, submit_query, prefetch_concurrently
+
+import functools
+import calendar
 import datetime
+import hashlib
+import base64
+import json
 import math
 
 
@@ -106,6 +131,305 @@ def get_fields(root, fields):
     return (prefetch, fwrap(ret))
 
 
+def plan_related(model, related):
+    """
+    Split the related lookups `get_fields` wants prefetched into those that
+    can be JOINed in with `select_related` (chains of forward foreign keys
+    and one-to-ones from `model`) and those that still need a
+    `prefetch_related` query (anything crossing a reverse or many-to-many
+    relation).
+
+    This returns a tuple of (select_related, prefetch_related) sets.
+    """
+    select, prefetch = set(), set()
+    for path in related:
+        current = model
+        for hop in path.split("__"):
+            try:
+                field, _, direct, m2m = current._meta.get_field_by_name(hop)
+            except FieldDoesNotExist:
+                field = None
+            if field is None or not direct or m2m or not field.rel:
+                prefetch.add(path)
+                break
+            current = field.rel.to
+        else:
+            select.add(path)
+    return select, prefetch
+
+
+def plan_columns(model, config, path=""):
+    """
+    Work out which columns the serialize `config` (as returned by
+    `get_fields`) reads off `model`, and off every related model it
+    descends into.
+
+    This returns a dict mapping each relation path ("" being `model`
+    itself) to a tuple of the model at that path and the set of field names
+    to load. The set is None where we can't tell what's needed -- a whole
+    object being serialized, a property, or a callable that isn't a plain
+    attribute lookup -- in which case every column gets loaded.
+
+    Primary keys, the foreign keys select_related / prefetch_related follow
+    and the foreign keys prefetched rows are matched back to their parents
+    by are always kept.
+    """
+    plan = {}
+    columns = {model._meta.pk.name}
+    if not is_compilable(config):
+        config, columns = {"fields": []}, None
+
+    for key, value in config['fields']:
+        if callable(value):
+            key, value = callable_attribute(value), {}
+            if key is None:
+                columns = None
+                continue
+        elif not isinstance(value, dict):
+            continue
+
+        try:
+            field, _, direct, m2m = model._meta.get_field_by_name(key)
+        except FieldDoesNotExist:
+            columns = None
+            continue
+
+        subpath = "%s__%s" % (path, key) if path else key
+        if m2m:
+            plan[subpath] = (field.rel.to if direct else field.model, None)
+        elif direct:
+            if columns is not None:
+                columns.add(field.name)
+            if field.rel and value != {}:
+                plan.update(plan_columns(field.rel.to, value, subpath))
+        else:
+            subplan = plan_columns(field.model, value, subpath)
+            if subplan[subpath][1] is not None:
+                subplan[subpath][1].add(field.field.name)
+            plan.update(subplan)
+
+    plan[path] = (model, columns)
+    return plan
+
+
+class FieldSpec(object):
+    """
+    The precompiled result of `get_fields` for one endpoint and one list
+    of fields. These are cached and shared between requests (and threads),
+    so treat them as read-only.
+
+    Use `apply` to set a query set up to fetch exactly what `serialize`
+    needs: to-one relations are JOINed with `select_related`, the rest are
+    prefetched, and (unless `IMAGO_PRUNE_COLUMNS` is off) columns nothing
+    reads are left out with `only()`, both on the root model and in the
+    prefetch query sets.
+    """
+
+    def __init__(self, model, fields, related, config):
+        select, prefetch = plan_related(model, related)
+        self.fields = fields
+        self.select_related = frozenset(select)
+        self.prefetch = frozenset(prefetch)
+        self.config = config
+
+        self.batched = []
+        if is_compilable(config):
+            self.batched = [x for _, x in config['fields'] if isinstance(x, BatchedField)]
+
+        self.only = None
+        self.prefetch_plan = [(x, None, None) for x in self.prefetch]
+        if getattr(settings, 'IMAGO_PRUNE_COLUMNS', True):
+            self.plan_columns(model)
+
+        if getattr(settings, 'IMAGO_COMPILE_SERIALIZERS', True):
+            self.serialize = compile_serializer(config)
+        else:
+            self.serialize = lambda obj, memo=None: serialize(obj, **config)
+
+    def plan_columns(self, model):
+        plan = plan_columns(model, self.config)
+        joined = set()
+        for path in self.select_related:
+            hops = path.split("__")
+            joined.update("__".join(hops[:i + 1]) for i in range(len(hops)))
+
+        root = plan[""][1]
+        if root is not None:
+            self.only = set(root)
+            # Restrict the JOINed models too, for as long as we know what
+            # they need; after that Django loads them in full.
+            for path in self.select_related:
+                hops = path.split("__")
+                for i in range(len(hops)):
+                    subpath = "__".join(hops[:i + 1])
+                    columns = plan.get(subpath, (None, None))[1]
+                    if columns is None:
+                        break
+                    self.only.update("%s__%s" % (subpath, x) for x in columns)
+            self.only = sorted(self.only)
+
+        # Only the plan is kept: Django sets hints on the query sets it's
+        # given to prefetch with, so each request gets its own (see
+        # `prefetch_lookups`).
+        prefetch_plan, seen = [], set()
+        for path in sorted(self.prefetch, key=lambda x: x.count("__")):
+            hops = path.split("__")
+            for i in range(len(hops)):
+                subpath = "__".join(hops[:i + 1])
+                if subpath in seen or subpath in joined:
+                    continue
+                seen.add(subpath)
+                submodel, columns = plan.get(subpath, (None, None))
+                if columns is not None:
+                    columns = tuple(sorted(columns))
+                prefetch_plan.append((subpath, submodel, columns))
+        self.prefetch_plan = prefetch_plan
+
+    def prefetch_lookups(self):
+        """
+        New `prefetch_related` lookups for the spec: plain paths, or
+        `Prefetch`es loading only the columns needed.
+        """
+        return [path if columns is None else
+                Prefetch(path, queryset=submodel.objects.only(*columns))
+                for path, submodel, columns in self.prefetch_plan]
+
+    def preload(self, objects):
+        """
+        Batch load the `BatchedField`s on the root of the spec for a page
+        of `objects`, rather than running their queries once per object.
+        """
+        for field in self.batched:
+            field.preload(objects)
+
+    def apply(self, queryset, prefetch=True):
+        """
+        Set `queryset` up to load everything `serialize` needs, and
+        nothing else. With `prefetch=False` the prefetches are left for
+        `prefetch_objects` to run on the fetched objects.
+        """
+        queryset = queryset.select_related(*self.select_related)
+        if self.only is not None:
+            queryset = queryset.only(*self.only)
+        if not prefetch:
+            return queryset
+        return queryset.prefetch_related(*self.prefetch_lookups())
+
+    def prefetch_objects(self, objects, concurrent=False):
+        """
+        Run the prefetches for a list of already fetched `objects`; with
+        `concurrent`, the independent ones side by side (see
+        imago.concurrency).
+        """
+        if not objects or not self.prefetch_plan:
+            return
+        if concurrent:
+            prefetch_concurrently(objects, self.prefetch_lookups())
+        else:
+            prefetch_related_objects(objects, self.prefetch_lookups())
+
+
+EMBED_MODES = ('inline', 'ref')
+
+
+def pop_embed(params):
+    """
+    Pop the `embed` param: 'inline' (the default) or 'ref'.
+    """
+    embed = params.pop('embed', 'inline')
+    if embed not in EMBED_MODES:
+        raise HttpError(400, "Error: embed must be one of: {}".format(', '.join(EMBED_MODES)))
+    return embed
+
+
+def serialize_objects(spec, objects, embed='inline'):
+    """
+    Serialize `objects` with `spec`, sharing one memo between them, so an
+    object embedded over and over is only serialized once. With
+    `embed='ref'` those repeated objects are taken out and returned as the
+    second value ({pk: object}), and referenced as {"ref": pk}; otherwise
+    that's None.
+    """
+    memo = {}
+    results = [spec.serialize(x, memo) for x in objects]
+    if embed != 'ref':
+        return results, None
+    return results, reference_repeated(results, memo)
+
+
+def normalize_fields(fields):
+    """
+    Turn a list of requested fields into a hashable cache key. Duplicates
+    are dropped, but the order is kept, since it decides the order of the
+    keys in the serialized output.
+    """
+    return tuple(OrderedDict.fromkeys(fields))
+
+
+@functools.lru_cache(maxsize=getattr(settings, 'IMAGO_FIELD_CACHE_SIZE', 256))
+def _compile_fields(endpoint, fields):
+    related, config = get_fields(endpoint.serialize_config, fields=fields)
+    return FieldSpec(endpoint.model, fields, related, config)
+
+
+def compile_fields(endpoint, fields):
+    """
+    Return the `FieldSpec` for `fields` on the `endpoint` class.
+
+    Almost all traffic asks for `default_fields` or one of a handful of
+    `fields=` lists, so rather than re-walking the serialize config on every
+    request, the result is kept in a bounded LRU cache keyed on the endpoint
+    class and the normalized fields. Hit / miss counters are available from
+    `compile_fields.cache_info()`.
+
+    This raises `FieldKeyError` just like `get_fields`; errors aren't cached.
+    """
+    return _compile_fields(endpoint, normalize_fields(fields))
+
+compile_fields.cache_info = _compile_fields.cache_info
+compile_fields.cache_clear = _compile_fields.cache_clear
+
+
+def compile_request_fields(endpoint, fields):
+    """
+    `compile_fields` for fields a request asked for, answering bad ones with
+    a 400.
+    """
+    try:
+        return compile_fields(endpoint, fields)
+    except FieldKeyError as e:
+        raise HttpError(400, "Error: You've asked for a field ({}) that "
+                        "is invalid. Valid fields are: {}".format(
+                            e.field, ', '.join(endpoint.serialize_config.keys()))
+                       )
+    except KeyError as e:
+        raise HttpError(400, "Error: Invalid field: %s" % (e))
+
+
+def encode_cursor(key, value, id_):
+    """
+    Encode the position after the last row of a page into an opaque
+    string for the client to pass back as `cursor=`.
+    """
+    payload = json.dumps([key, value, id_], default=lambda x: (
+        x.isoformat() if hasattr(x, 'isoformat') else str(x)
+    ))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """
+    Reverse `encode_cursor`, returning a (key, value, id) tuple. Raises
+    ValueError if this isn't a cursor we handed out.
+    """
+    try:
+        key, value, id_ = json.loads(
+            base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+    except (TypeError, ValueError):
+        raise ValueError(cursor)
+    return key, value, id_
+
+
 def cachebusterable(fn):
     """
     Allow front-end tools to pass a "_" pararm with different arguments
@@ -130,7 +454,9 @@ def no_authentication_or_is_authenticated():
 def authenticated(fn):
     """ ensure that request.apikey is valid """
     def _(self, request, *args, **kwargs):
-        if no_authentication_or_is_authenticated():
+        with self.phase('auth'):
+            allowed = no_authentication_or_is_authenticated()
+        if allowed:
             if 'apikey' in request.params:
                 request.params.pop('apikey')
 
@@ -141,6 +467,52 @@ def authenticated(fn):
     return _
 
 
+def make_etag(*parts):
+    """
+    Build a (quoted) ETag from anything with a stable repr. The imago
+    version is mixed in, so a deploy changing the output busts them.
+    """
+    key = repr((__version__,) + parts).encode('utf-8')
+    return quote_etag(hashlib.sha1(key).hexdigest())
+
+
+class ConditionalMixin(object):
+    """
+    Conditional GET support. The data only changes when the scrapers
+    import, so views work out an ETag and Last-Modified from `updated_at`
+    before doing any real work, and answer with a 304 if the client already
+    has the current version.
+    """
+
+    def has_updated_at(self):
+        return any(f.name == 'updated_at' for f in self.model._meta.fields)
+
+    def is_not_modified(self, request, etag, last_modified):
+        if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+        if if_none_match is not None:
+            etags = parse_etags(if_none_match)
+            return '*' in etags or etag.strip('"') in etags
+
+        if_modified_since = parse_http_date_safe(
+            request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+        if if_modified_since is None or last_modified is None:
+            return False
+        return calendar.timegm(last_modified.utctimetuple()) <= if_modified_since
+
+    def set_validators(self, response, etag, last_modified):
+        response['ETag'] = etag
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(
+                calendar.timegm(last_modified.utctimetuple()))
+        return response
+
+    def not_modified(self, etag, last_modified):
+        response = self.set_validators(HttpResponseNotModified(), etag,
+                                       last_modified)
+        response['Access-Control-Allow-Origin'] = "*"
+        return response
+
+
 class DebugMixin(object):
 
     def start_debug(self):
@@ -153,6 +525,7 @@ class DebugMixin(object):
             end_time = datetime.datetime.utcnow()
             connection = connections['default']
             end_queries = len(connection.queries)
+            groups = group_queries(connection.queries[self.start_queries:end_queries])
 
             return {
                 "connection": {
@@ -161,6 +534,8 @@ class DebugMixin(object):
                         "count_end": end_queries,
                         "count": (end_queries - self.start_queries),
                         "list": connection.queries,
+                        "groups": groups,
+                        "repeated": repeated_queries(groups),
                     },
                     "dsn": connection.connection.dsn,
                     "vendor": connection.vendor,
@@ -177,7 +552,27 @@ class DebugMixin(object):
             }
 
 
-class PublicListEndpoint(ListEndpoint, DebugMixin):
+class StreamingMixin(object):
+    """
+    Lets views send a `StreamingHttpResponse`. restless sends anything that
+    isn't an `HttpResponse` as JSON, so the view passes the stream to
+    `stream()`, and it's put back in once restless is done with it.
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        self.streaming_response = None
+        response = super(StreamingMixin, self).dispatch(request, *args, **kwargs)
+        if self.streaming_response is not None:
+            return self.streaming_response
+        return response
+
+    def stream(self, response):
+        self.streaming_response = response
+        return HttpResponse()
+
+
+class PublicListEndpoint(MetricsMixin, QueryBudgetMixin, TimingMixin, CompressionMixin,
+                         StreamingMixin, ListEndpoint, ConditionalMixin, DebugMixin):
     """
     Imago public list API helper class.
 
@@ -201,12 +596,18 @@ class PublicListEndpoint(ListEndpoint, DebugMixin):
     As a result, JSONP is disabled. Read more on using CORS:
        - http://en.wikipedia.org/wiki/Cross-origin_resource_sharing
 
+    Pages counted exactly (`count=exact`) carry an ETag and Last-Modified
+    built from the newest `updated_at` and the number of the filtered rows
+    and the request params, and conditional requests are answered with a
+    304 before any pagination or serialization.
+
     The 'get' class-based view method invokes the following helpers:
 
 
         [ Methods ]
          - get_query_set  | Get the Django query set for the request.
          - filter         | Filter the resulting query set.
+         - search         | Narrow it down to the `q` matches, ranked.
          - sort           | Sort the filtered query set
          - paginate       | Paginate the sorted query set
 
@@ -220,12 +621,29 @@ class PublicListEndpoint(ListEndpoint, DebugMixin):
 
          - serialize_config | Object serializion to use. Many are in
                             | the imago.serialize module
+
+         - default_count    | How to work out `total_count` if no `count`
+                            | param is passed in: 'exact', 'estimate' or
+                            | 'none'.
+
+         - export_chunk_size | Rows fetched (and prefetched) at a time when
+                             | streaming `format=ndjson` exports.
+
+         - max_queries      | Query budget for requests using the
+                            | `default_fields` (see imago.queries).
+
+         - search_fields    | Fields the `q` param searches (see
+                            | imago.search); empty if it can't be used.
     """
 
     methods = ['GET']
     max_per_page = 100
     serialize_config = {}
     default_fields = []
+    default_count = 'exact'
+    count_modes = ('exact', 'estimate', 'none')
+    export_chunk_size = 500
+    search_fields = []
 
     def adjust_filters(self, params):
         """
@@ -248,6 +666,17 @@ class PublicListEndpoint(ListEndpoint, DebugMixin):
         except Exception:
             raise HttpError(500, "Error: Something went wrong with your request")
 
+    def search(self, data, query):
+        """
+        Full-text search the filtered query set for `query` with the
+        configured search backend. The matches come back ranked, best
+        first, and without duplicates.
+        """
+        if not self.search_fields:
+            raise HttpError(400, "Error: this endpoint can't be searched")
+        data = self.model.objects.filter(id__in=data.values('id'))
+        return get_search_backend().search(data, query, self.search_fields)
+
     def sort(self, data, sort_by):
         """
         Sort the Django query set. The sort_by param will be
@@ -265,6 +694,159 @@ class PublicListEndpoint(ListEndpoint, DebugMixin):
         paginator = Paginator(data, per_page=per_page)
         return paginator.page(page)
 
+    def paginate_uncounted(self, data, page, per_page):
+        """
+        Paginate the Django response without asking the database how many
+        rows there are in total. This returns the list of objects on the
+        page.
+        """
+        if page < 1:
+            raise EmptyPage(page)
+        object_list = list(data[(page - 1) * per_page:page * per_page])
+        if not object_list and page != 1:
+            raise EmptyPage(page)
+        return object_list
+
+    def count_cache_key(self, params):
+        """
+        Cache key for the total count of this view with the given filter
+        params.
+        """
+        key = repr((type(self).__module__, type(self).__name__,
+                    sorted(params.items())))
+        return "imago:count:%s" % (hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+    def cache_count(self, params, count):
+        cache.set(self.count_cache_key(params), count,
+                  getattr(settings, 'IMAGO_COUNT_CACHE_TTL', 300))
+
+    def estimate_count(self, data):
+        """
+        Ask the Postgres planner how many rows it thinks the query set
+        will return, which costs about as much as planning the query.
+        """
+        try:
+            sql, sql_params = data.query.sql_with_params()
+        except EmptyResultSet:
+            # Django knows without asking, e.g. `id__in=[]` or `none()`.
+            return 0
+        with connections[data.db].cursor() as cursor:
+            cursor.execute("EXPLAIN (FORMAT JSON) " + sql, sql_params)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return plan[0]['Plan']['Plan Rows']
+
+    def count(self, data, mode, params):
+        """
+        Count the (distinct) rows in the filtered query set using `mode`,
+        which is either 'exact' or 'estimate'.
+
+        An estimate is the last exact count for the same filters if we've
+        done one recently (see `IMAGO_COUNT_CACHE_TTL`), otherwise the
+        planner's guess.
+
+        This returns the count and the mode that actually produced it:
+        'exact', 'cached' or 'estimate'.
+        """
+        if mode == 'estimate':
+            count = cache.get(self.count_cache_key(params))
+            if count is not None:
+                return count, 'cached'
+            return self.estimate_count(data), 'estimate'
+
+        count = data.count()
+        self.cache_count(params, count)
+        return count, 'exact'
+
+    def paginate_cursor(self, data, cursor, per_page, sort_by):
+        """
+        Keyset paginate the (unsorted) Django query set. Rather than an
+        OFFSET, the `cursor` encodes the sort key and id of the last row the
+        client saw, so fetching page 10,000 costs as much as page 1.
+
+        Only a single sort field on the model itself is supported, with `id`
+        as the tie-breaker. An empty `cursor` starts from the beginning.
+
+        This returns the list of objects and the cursor for the next page,
+        which is None once we've run out of rows.
+        """
+        if len(sort_by) > 1:
+            raise HttpError(400, "Error: cursor pagination can only sort on one field")
+
+        key = sort_by[0] if sort_by else 'id'
+        descending = key.startswith('-')
+        name = key.lstrip('-')
+        try:
+            attname = self.model._meta.get_field(name).attname
+        except FieldDoesNotExist:
+            raise HttpError(400, "Error: can't sort a cursor on %s" % (name))
+
+        op = 'lt' if descending else 'gt'
+        sign = '-' if descending else ''
+        if attname == 'id':
+            data = data.order_by(sign + 'id').distinct('id')
+        else:
+            data = data.order_by(sign + attname, sign + 'id').distinct(attname, 'id')
+
+        if cursor:
+            try:
+                cursor_key, value, last_id = decode_cursor(cursor)
+            except ValueError:
+                raise HttpError(400, "Error: invalid cursor")
+            if cursor_key != key:
+                raise HttpError(400, "Error: cursor was made with a different sort")
+
+            after = Q(**{'id__' + op: last_id})
+            if attname != 'id':
+                # Postgres puts NULLs last when ascending, first when not.
+                if value is None:
+                    after &= Q(**{attname + '__isnull': True})
+                    if descending:
+                        after |= Q(**{attname + '__isnull': False})
+                else:
+                    after = Q(**{attname + '__' + op: value}) | (
+                        after & Q(**{attname: value}))
+                    if not descending:
+                        after |= Q(**{attname + '__isnull': True})
+            data = data.filter(after)
+
+        object_list = list(data[:per_page + 1])
+        if len(object_list) <= per_page:
+            return object_list, None
+
+        object_list = object_list[:per_page]
+        last = object_list[-1]
+        return object_list, encode_cursor(key, getattr(last, attname), last.id)
+
+    def export(self, data, spec, sort_by):
+        """
+        Stream every row of the (unsorted) Django query set as
+        newline-delimited JSON, serialized with `spec`.
+
+        Rows are read `export_chunk_size` at a time by walking the keyset
+        cursor, and each chunk is prefetched and serialized on its own, so
+        memory stays flat however big the result is.
+        """
+        chunk_size = self.export_chunk_size
+        # The first chunk is fetched now, so bad params are still a 400.
+        object_list, cursor = self.paginate_cursor(data, '', chunk_size, sort_by)
+
+        def rows(object_list, cursor):
+            while True:
+                spec.preload(object_list)
+                memo = {}
+                yield b"".join(render(spec.serialize(x, memo)) + b"\n" for x in object_list)
+                if cursor is None:
+                    return
+                object_list, cursor = self.paginate_cursor(data, cursor, chunk_size,
+                                                           sort_by)
+
+        response = StreamingHttpResponse(rows(object_list, cursor),
+                                         content_type='application/x-ndjson; charset=utf-8')
+        response['Access-Control-Allow-Origin'] = "*"
+        return response
+
     @authenticated
     @cachebusterable
     def get(self, request, *args, **kwargs):
@@ -272,11 +854,27 @@ class PublicListEndpoint(ListEndpoint, DebugMixin):
         Default 'GET' class-based view.
         """
 
+        self.start_debug()
         params = request.params
+        request_params = sorted(params.items())
 
         # default to page 1
         page = int(params.pop('page', 1))
         per_page = min(self.max_per_page, int(params.pop('per_page', self.max_per_page)))
+        cursor = params.pop('cursor', None)
+
+        export_format = params.pop('format', None)
+        if export_format is not None and export_format != 'ndjson':
+            raise HttpError(400, "Error: the only export format is ndjson")
+
+        count_mode = params.pop('count', None)
+        if count_mode is not None and count_mode not in self.count_modes:
+            raise HttpError(400, "Error: count must be one of: {}".format(
+                ', '.join(self.count_modes)))
+
+        embed = pop_embed(params)
+        if embed == 'ref' and export_format is not None:
+            raise HttpError(400, "Error: exports can't use embed=ref")
 
         sort_by = []
         if 'sort' in params:
@@ -286,60 +884,158 @@ class PublicListEndpoint(ListEndpoint, DebugMixin):
         if 'fields' in params:
             fields = params.pop('fields').split(",")
 
-        data = self.get_query_set(request, *args, **kwargs)
-        data = self.filter(data, **params)
-        data = self.sort(data, sort_by)
-        data = data.distinct("id")
-
-        try:
-            related, config = get_fields(self.serialize_config, fields=fields)
-        except FieldKeyError as e:
-            raise HttpError(400, "Error: You've asked for a field ({}) that "
-                            "is invalid. Valid fields are: {}".format(
-                                e.field, ', '.join(self.serialize_config.keys()))
-                           )
-        except KeyError as e:
-            raise HttpError(400, "Error: Invalid field: %s" % (e))
-
-        data = data.prefetch_related(*related)
-
-        try:
-            data_page = self.paginate(data, page, per_page)
-        except EmptyPage:
-            raise HttpError(404, 'No such page (heh, literally - its out of bounds)')
-
-        self.start_debug()
-
-        count = data_page.paginator.count
+        # `q` stays in params, so counts are cached per search.
+        query = params.get('q')
+
+        with self.phase('filter'):
+            data = self.get_query_set(request, *args, **kwargs)
+            data = self.filter(data, **dict((k, v) for k, v in params.items() if k != 'q'))
+        if query:
+            with self.phase('search'):
+                data = self.search(data, query)
+
+        # Working out the validators reads every matching row, which cursor
+        # pages, exports and count=none or count=estimate pages are there to
+        # avoid, so those go without.
+        conditional = (cursor is None and export_format is None and
+                       (count_mode or self.default_count) == 'exact')
+
+        etag, last_modified, count = None, None, None
+        if conditional and self.has_updated_at():
+            with self.phase('etag'):
+                # The count catches rows that were deleted or stopped
+                # matching, which leave the newest `updated_at` as it was.
+                # It's also the page's exact count, so that isn't run again.
+                latest = data.aggregate(Max('updated_at'), Count('id', distinct=True))
+                last_modified, count = latest['updated_at__max'], latest['id__count']
+                etag = make_etag(type(self).__name__, request_params, last_modified, count)
+            if self.is_not_modified(request, etag, last_modified):
+                return self.not_modified(etag, last_modified)
+            cached = self.cached_response(request, etag, last_modified)
+            if cached is not None:
+                return cached
+
+        if cursor is None and export_format is None:
+            if not query:
+                data = self.sort(data, sort_by)
+                data = data.distinct("id")
+            elif sort_by:
+                # Search results are distinct already, and ranked unless
+                # another order is asked for.
+                data = self.sort(data, sort_by)
+
+        with self.phase('compile'):
+            spec = compile_request_fields(type(self), fields)
+
+        related = spec.prefetch
+
+        if export_format is not None:
+            response = self.export(spec.apply(data), spec, sort_by)
+            if etag is not None:
+                self.set_validators(response, etag, last_modified)
+            return self.stream(response)
+
+        # The page's prefetches are run (and timed) separately, below.
+        data = spec.apply(data, prefetch=False)
+
+        if cursor is not None:
+            with self.phase('fetch'):
+                object_list, next_cursor = self.paginate_cursor(data, cursor, per_page,
+                                                                sort_by)
+            meta = {
+                "count": len(object_list),
+                "per_page": per_page,
+                "next_cursor": next_cursor,
+            }
 
-        response = {
-            "meta": {
-                "count": len(data_page.object_list),
+            # Counting defeats the point of a cursor, so only do it if asked.
+            count_mode = count_mode or 'none'
+            if count_mode != 'none':
+                with self.phase('count'):
+                    meta['total_count'], count_mode = self.count(data.distinct("id"),
+                                                                 count_mode, params)
+        else:
+            count_mode = count_mode or self.default_count
+            try:
+                if count_mode == 'exact' and count is not None:
+                    # Counted along with the validators.
+                    with self.phase('fetch'):
+                        object_list = self.paginate_uncounted(data, page, per_page)
+                elif count_mode == 'exact' and concurrent_queries_enabled():
+                    # The COUNT runs on another connection meanwhile.
+                    with self.phase('fetch'):
+                        counting = submit_query(data.count)
+                        object_list = self.paginate_uncounted(data, page, per_page)
+                    with self.phase('count'):
+                        count = counting.result()
+                elif count_mode == 'exact':
+                    # The Paginator counts first, then slices the page.
+                    with self.phase('count'):
+                        data_page = self.paginate(data, page, per_page)
+                        count = data_page.paginator.count
+                    with self.phase('fetch'):
+                        object_list = list(data_page.object_list)
+                else:
+                    with self.phase('fetch'):
+                        object_list = self.paginate_uncounted(data, page, per_page)
+            except EmptyPage:
+                raise HttpError(404, 'No such page (heh, literally - its out of bounds)')
+
+            meta = {
+                "count": len(object_list),
                 "page": page,
                 "per_page": per_page,
-                "max_page": math.ceil(count / per_page),
-                "total_count": count,
-            }, "results": [
-                serialize(x, **config) for x in data_page.object_list
-            ]
-        }
+            }
+
+            if count_mode == 'exact':
+                self.cache_count(params, count)
+            elif count_mode == 'estimate':
+                with self.phase('count'):
+                    count, count_mode = self.count(data, count_mode, params)
+
+            if count_mode != 'none':
+                meta['max_page'] = math.ceil(count / per_page)
+                meta['total_count'] = count
+
+        meta['count_mode'] = count_mode
+
+        with self.phase('prefetch'):
+            spec.prefetch_objects(object_list, concurrent_queries_enabled())
+            spec.preload(object_list)
+        self.rows_serialized = len(object_list)
+        with self.phase('serialize'):
+            results, included = serialize_objects(spec, object_list, embed)
+            response = {
+                "meta": meta,
+                "results": results,
+            }
+            if included is not None:
+                response['included'] = included
 
         if settings.DEBUG:
             response['debug'] = self.get_debug()
             response['debug'].update({
                 "prefetch_fields": list(related),
+                "select_related_fields": list(spec.select_related),
+                "only_fields": spec.only,
                 "page": page,
                 "sort": sort_by,
                 "field": fields,
+                "field_cache": compile_fields.cache_info()._asdict(),
+                "timing": self.timer.as_dict(),
             })
 
-        response = Http200(response)
+        with self.phase('render'):
+            response = JSONResponse(response)
+        if etag is not None:
+            self.set_validators(response, etag, last_modified)
 
         response['Access-Control-Allow-Origin'] = "*"
         return response
 
 
-class PublicDetailEndpoint(DetailEndpoint, DebugMixin):
+class PublicDetailEndpoint(MetricsMixin, QueryBudgetMixin, TimingMixin, CompressionMixin,
+                           DetailEndpoint, ConditionalMixin, DebugMixin):
     """
     Imago public detail view API helper class.
 
@@ -355,6 +1051,14 @@ class PublicDetailEndpoint(DetailEndpoint, DebugMixin):
     As a result, JSONP is disabled. Read more on using CORS:
        - http://en.wikipedia.org/wiki/Cross-origin_resource_sharing
 
+    Responses carry an ETag and Last-Modified built from the object's
+    `updated_at`, which is looked up on its own first, so conditional
+    requests get a 304 without running the prefetches or serialization.
+
+    Routed without a `pk`, the view answers batch requests instead: `id`
+    is a comma separated list of ids, and all those objects are fetched
+    with one set of queries, returned in the order asked for, with the ids
+    that don't exist listed in `meta.missing`.
 
     The 'get' class-based view method uses the following object properties:
 
@@ -365,34 +1069,161 @@ class PublicDetailEndpoint(DetailEndpoint, DebugMixin):
 
          - serialize_config | Object serializion to use. Many are in
                             | the imago.serialize module
+
+         - max_queries      | Query budget for requests using the
+                            | `default_fields` (see imago.queries).
+
+         - max_batch_size   | Most ids a batch request can ask for.
+
+         - document_store   | Serve prebuilt documents when they're fresh
+                            | (see imago.documents).
     """
 
     methods = ['GET']
+    max_batch_size = 500
+    document_store = False
 
     @authenticated
     @cachebusterable
-    def get(self, request, pk, *args, **kwargs):
+    def get(self, request, pk=None, *args, **kwargs):
+        self.start_debug()
+        if pk is None:
+            return self.get_batch(request)
         params = request.params
 
         fields = self.default_fields
         if 'fields' in params:
             fields = params.pop('fields').split(",")
 
-        related, config = get_fields(self.serialize_config, fields=fields)
-
-        self.start_debug()
+        with self.phase('compile'):
+            spec = compile_request_fields(type(self), fields)
+        related = spec.prefetch
+
+        etag, last_modified = None, None
+        if self.has_updated_at():
+            try:
+                with self.phase('etag'):
+                    last_modified = self.model.objects.filter(pk=pk).values_list(
+                        'updated_at', flat=True).get()
+            except ObjectDoesNotExist as e:
+                raise HttpError(404, "Error: {}".format(e))
+            etag = make_etag(type(self).__name__, pk, spec.fields, last_modified)
+            if self.is_not_modified(request, etag, last_modified):
+                return self.not_modified(etag, last_modified)
+            cached = self.cached_response(request, etag, last_modified)
+            if cached is not None:
+                return cached
+
+            if self.document_store and document_store_enabled():
+                with self.phase('document'):
+                    content = get_document(type(self), spec, pk, last_modified)
+                if content is not None:
+                    response = HttpResponse(content, content_type=CONTENT_TYPE)
+                    self.set_validators(response, etag, last_modified)
+                    response['Access-Control-Allow-Origin'] = "*"
+                    return response
 
         try:
-            obj = self.model.objects.prefetch_related(*related).get(pk=pk)
+            with self.phase('fetch'):
+                obj = spec.apply(self.model.objects.all(), prefetch=False).get(pk=pk)
         except ObjectDoesNotExist as e:
             raise HttpError(404, "Error: {}".format(e))
         except Exception:
             raise HttpError(500, "Error: Something went wrong with your request")
 
-        serialized = serialize(obj, **config)
+        with self.phase('prefetch'):
+            spec.prefetch_objects([obj], concurrent_queries_enabled())
+            spec.preload([obj])
+        self.rows_serialized = 1
+        with self.phase('serialize'):
+            serialized = spec.serialize(obj)
         serialized['debug'] = self.get_debug()
+        if serialized['debug'] is not None:
+            serialized['debug'].update({
+                "prefetch_fields": list(related),
+                "select_related_fields": list(spec.select_related),
+                "timing": self.timer.as_dict(),
+            })
 
-        response = Http200(serialized)
+        with self.phase('render'):
+            response = JSONResponse(serialized)
+        if etag is not None:
+            self.set_validators(response, etag, last_modified)
         response['Access-Control-Allow-Origin'] = "*"
 
         return response
+
+    def get_batch(self, request):
+        """
+        The objects for the comma separated ids in the `id` param.
+        """
+        params = request.params
+
+        ids = []
+        for id_ in params.pop('id', '').split(','):
+            if id_ and id_ not in ids:
+                ids.append(id_)
+        if not ids:
+            raise HttpError(400, "Error: pass the ids to get as id=<id>,<id>,...")
+        if len(ids) > self.max_batch_size:
+            raise HttpError(400, "Error: at most {} ids can be asked for at once".format(
+                self.max_batch_size))
+
+        fields = self.default_fields
+        if 'fields' in params:
+            fields = params.pop('fields').split(",")
+        embed = pop_embed(params)
+
+        with self.phase('compile'):
+            spec = compile_request_fields(type(self), fields)
+
+        etag, last_modified = None, None
+        if self.has_updated_at():
+            with self.phase('etag'):
+                latest = self.model.objects.filter(pk__in=ids).aggregate(
+                    Max('updated_at'), Count('id'))
+            last_modified = latest['updated_at__max']
+            # The count changes when one of the objects is deleted.
+            etag = make_etag(type(self).__name__, ids, spec.fields, embed, last_modified,
+                             latest['id__count'])
+            if self.is_not_modified(request, etag, last_modified):
+                return self.not_modified(etag, last_modified)
+            cached = self.cached_response(request, etag, last_modified)
+            if cached is not None:
+                return cached
+
+        with self.phase('fetch'):
+            found = {x.pk: x for x in
+                     spec.apply(self.model.objects.all(), prefetch=False).filter(pk__in=ids)}
+        object_list = [found[x] for x in ids if x in found]
+
+        with self.phase('prefetch'):
+            spec.prefetch_objects(object_list, concurrent_queries_enabled())
+            spec.preload(object_list)
+        self.rows_serialized = len(object_list)
+        with self.phase('serialize'):
+            results, included = serialize_objects(spec, object_list, embed)
+            response = {
+                "meta": {
+                    "count": len(object_list),
+                    "missing": [x for x in ids if x not in found],
+                },
+                "results": results,
+            }
+            if included is not None:
+                response['included'] = included
+
+        if settings.DEBUG:
+            response['debug'] = self.get_debug()
+            response['debug'].update({
+                "prefetch_fields": list(spec.prefetch),
+                "select_related_fields": list(spec.select_related),
+                "timing": self.timer.as_dict(),
+            })
+
+        with self.phase('render'):
+            response = JSONResponse(response)
+        if etag is not None:
+            self.set_validators(response, etag, last_modified)
+        response['Access-Control-Allow-Origin'] = "*"
+        return response
@@ -0,0 +1,170 @@
+# Copyright (c) Sunlight Foundation, 2014, under the BSD-3 License.
+
+from django.conf import settings
+from django.db.models import Max
+from django.utils.dateparse import parse_datetime
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+
+from . import views
+from .helpers import compile_fields
+
+import pyelasticsearch
+
+"""
+Fills and maintains the ElasticSearch index behind
+`imago.search.ElasticSearchBackend`.
+
+Each model gets its own document type (the model name), and the documents
+are the objects as the model's list endpoint serializes them with its
+default fields, so they carry the `search_fields` and look like API
+results. Objects are read in chunks in id order, with their prefetches,
+and each chunk goes out as one bulk request on a small thread pool while
+the next one is read.
+
+Runs are incremental: after a successful run, the newest `updated_at` seen
+when it started is stored in the index (as an `imago_state` document per
+model), and the next run only sends objects updated since then. Deletions
+aren't picked up; rebuild the index for those.
+"""
+
+INDEXED_VIEWS = ('BillList', 'PeopleList', 'OrganizationList', 'EventList')
+STATE_TYPE = 'imago_state'
+
+
+def search_index():
+    return getattr(settings, 'IMAGO_SEARCH_INDEX', 'imago')
+
+
+def get_client(host=None):
+    """
+    The `imago.core` client, or one for `host` if given.
+    """
+    if host is None:
+        from .core import elasticsearch
+        return elasticsearch
+    return pyelasticsearch.ElasticSearch(host,
+                                         timeout=getattr(settings, 'ELASTICSEARCH_TIMEOUT', 60))
+
+
+def doc_type(model):
+    return model._meta.model_name
+
+
+def get_high_water(es, index, model):
+    try:
+        state = es.get(index, STATE_TYPE, doc_type(model))
+    except pyelasticsearch.ElasticHttpNotFoundError:
+        return None
+    return parse_datetime(state['_source']['updated_at'])
+
+
+def set_high_water(es, index, model, updated_at):
+    es.index(index, STATE_TYPE, {'updated_at': updated_at.isoformat()},
+             id=doc_type(model), refresh=True)
+
+
+def stream_documents(view, queryset, chunk_size):
+    """
+    Yield lists of up to `chunk_size` documents for the objects in
+    `queryset`, serialized with the view's default fields.
+    """
+    spec = compile_fields(view, view.default_fields)
+    queryset = spec.apply(queryset.order_by('id'), prefetch=False)
+    last = None
+    while True:
+        chunk = queryset if last is None else queryset.filter(id__gt=last)
+        chunk = list(chunk[:chunk_size])
+        if not chunk:
+            return
+        spec.prefetch_objects(chunk)
+        spec.preload(chunk)
+        yield [spec.serialize(x) for x in chunk]
+        if len(chunk) < chunk_size:
+            return
+        last = chunk[-1].id
+
+
+def bulk_errors(items):
+    """
+    The results of the bulk response items that failed.
+    """
+    errors = []
+    for item in items:
+        result = list(item.values())[0]
+        if 'error' in result:
+            errors.append(result)
+    return errors
+
+
+class Indexer(object):
+    """
+    Indexes the `INDEXED_VIEWS` models into `index`, sending up to
+    `workers` bulk requests at a time.
+    """
+
+    def __init__(self, es, index=None, chunk_size=500, workers=4, log=None):
+        self.es = es
+        self.index = index or search_index()
+        self.chunk_size = chunk_size
+        self.workers = workers
+        self.log = log or (lambda *args: None)
+
+    def send(self, model, docs):
+        """
+        Send one bulk request, returning the failed items.
+        """
+        try:
+            response = self.es.bulk_index(self.index, doc_type(model), docs)
+        except getattr(pyelasticsearch, 'BulkError', ()) as e:
+            # pyelasticsearch 1.0 and later raise on failed items.
+            return bulk_errors(e.errors)
+        return bulk_errors(response.get('items', []))
+
+    def index_view(self, view, full=False):
+        """
+        Index the view's model, returning the number of documents sent and
+        the failed bulk items. The high-water mark only moves if nothing
+        failed.
+        """
+        model = view.model
+        queryset = model.objects.all()
+
+        # Everything updated after this is left for the next run.
+        until = queryset.aggregate(Max('updated_at'))['updated_at__max']
+        if until is None:
+            return 0, []
+        since = None if full else get_high_water(self.es, self.index, model)
+        if since is not None:
+            # Objects saved in the same instant as the last mark might not
+            # have been seen then; sending them again is harmless.
+            queryset = queryset.filter(updated_at__gte=since)
+        queryset = queryset.filter(updated_at__lte=until)
+
+        sent, errors = 0, []
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for docs in stream_documents(view, queryset, self.chunk_size):
+                # Don't read ahead more than a chunk per worker.
+                while len(pending) >= self.workers:
+                    errors.extend(pending.popleft().result())
+                pending.append(pool.submit(self.send, model, docs))
+                sent += len(docs)
+                self.log(model, sent)
+            while pending:
+                errors.extend(pending.popleft().result())
+
+        if not errors:
+            set_high_water(self.es, self.index, model, until)
+        return sent, errors
+
+    def run(self, names=None, full=False):
+        """
+        Index the named views (by default all of `INDEXED_VIEWS`),
+        returning {model name: (documents sent, failed items)}.
+        """
+        results = {}
+        for name in (names or INDEXED_VIEWS):
+            view = getattr(views, name)
+            results[doc_type(view.model)] = self.index_view(view, full=full)
+        return results
@@ -0,0 +1,91 @@
+import json
+from optparse import make_option
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import (override_settings, setup_test_environment,
+                               teardown_test_environment)
+from ...benchmark import DatasetGenerator, run_benchmark, compare, environment
+
+
+class Command(BaseCommand):
+    help = ('benchmark every API endpoint against a generated data set, '
+            'optionally failing on regressions against a baseline')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--scale', type='int', dest='scale', default=1,
+                    help='Size of the generated data set, in units of 5 jurisdictions.'),
+        make_option('--seed', type='int', dest='seed', default=0,
+                    help='Random seed for the generated data set.'),
+        make_option('--requests', type='int', dest='requests', default=20,
+                    help='Timed requests per endpoint and field set.'),
+        make_option('--warmup', type='int', dest='warmup', default=2,
+                    help='Untimed requests per endpoint and field set.'),
+        make_option('--output', dest='output', default=None,
+                    help='Write the results as JSON to this file.'),
+        make_option('--baseline', dest='baseline', default=None,
+                    help='Compare against results previously written with --output.'),
+        make_option('--tolerance', type='float', dest='tolerance', default=0.25,
+                    help='Allowed p95 latency and peak memory increase over the '
+                    'baseline, as a fraction.'),
+        make_option('--apikey', dest='apikey', default=None,
+                    help='API key to send, if authentication is on.'),
+        make_option('--existing', action='store_true', dest='existing', default=False,
+                    help='Benchmark the configured database as it is, rather than '
+                    'a test database with a generated data set.'),
+    )
+
+    def handle(self, *args, **options):
+        if options['requests'] < 1:
+            raise CommandError('--requests must be at least 1')
+
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)
+
+        setup_test_environment()
+        old_name = None
+        try:
+            if not options['existing']:
+                old_name = connection.settings_dict['NAME']
+                connection.creation.create_test_db(verbosity=0, autoclobber=True,
+                                                  serialize=False)
+                counts = DatasetGenerator(options['scale'], options['seed']).generate()
+                print('generated', ', '.join('{} {}'.format(v, k)
+                                             for k, v in sorted(counts.items())))
+
+            params = {'apikey': options['apikey']} if options['apikey'] else None
+            with override_settings(ROOT_URLCONF='imago.urls', DEBUG=False):
+                results = run_benchmark(options['requests'], options['warmup'],
+                                        params=params, log=self.log)
+        finally:
+            if old_name is not None:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        report = {
+            "environment": environment(),
+            "options": {k: options[k] for k in ('scale', 'seed', 'requests', 'warmup',
+                                                'existing')},
+            "results": results,
+        }
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2, sort_keys=True)
+
+        if baseline is not None:
+            if baseline.get('options') != report['options']:
+                print('warning: baseline was run with different options:',
+                      baseline.get('options'))
+            regressions = compare(results, baseline['results'], options['tolerance'])
+            for regression in regressions:
+                print('REGRESSION', regression)
+            if regressions:
+                raise CommandError('{} regressions against {}'.format(
+                    len(regressions), options['baseline']))
+            print('no regressions against', options['baseline'])
+
+    def log(self, key, result):
+        print('{:<32} {:>4} {:>8.4f}s {:>8.4f}s {:>8.4f}s {:>4}q {:>10}'.format(
+            key, result['status'], result['p50'], result['p95'], result['p99'],
+            result['queries'], result['peak_memory'] or '-'))
@@ -0,0 +1,54 @@
+import json
+from optparse import make_option
+from django.core.management.base import BaseCommand, CommandError
+from ... import views
+from ...helpers import compile_fields
+from ...renderers import get_renderer, render_json
+from .benchserialize import DEFAULT_VIEWS, bench
+
+
+class Command(BaseCommand):
+    args = '[view ...]'
+    help = ('benchmark the configured JSON renderer (IMAGO_JSON_RENDERER) against '
+            'the standard library on pages serialized with the given views')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--rows', type='int', dest='rows', default=100,
+                    help='Number of objects per page.'),
+        make_option('--repeat', type='int', dest='repeat', default=20,
+                    help='Number of timing runs, the best one is reported.'),
+        make_option('--renderer', dest='renderer', default=None,
+                    help='Renderer to compare, instead of IMAGO_JSON_RENDERER.'),
+    )
+
+    def handle(self, *args, **options):
+        renderer = get_renderer(options['renderer'])
+
+        for name in (args or DEFAULT_VIEWS):
+            view = getattr(views, name, None)
+            if view is None or not hasattr(view, 'default_fields'):
+                raise CommandError('no such view: {}'.format(name))
+
+            spec = compile_fields(view, view.default_fields)
+            objects = list(spec.apply(view.model.objects.all())[:options['rows']])
+            spec.preload(objects)
+            payload = {
+                "meta": {"count": len(objects)},
+                "results": [spec.serialize(x) for x in objects],
+            }
+
+            expected = render_json(payload)
+            got = renderer(payload)
+            if json.loads(got.decode('utf-8')) != json.loads(expected.decode('utf-8')):
+                raise CommandError('{}: {} output differs from json'.format(
+                    name, renderer.__name__))
+
+            before = bench(lambda: render_json(payload), options['repeat'])
+            after = bench(lambda: renderer(payload), options['repeat'])
+
+            print('{} ({} objects, {} bytes)'.format(name, len(objects), len(expected)))
+            print('  json:      {:.6f}s'.format(before))
+            print('  {:<10} {:.6f}s'.format(renderer.__name__.replace('render_', '') + ':',
+                                            after))
+            if after:
+                print('  speedup:   {:.2f}x'.format(before / after))
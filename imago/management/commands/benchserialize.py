@@ -0,0 +1,57 @@
+import json
+import timeit
+from optparse import make_option
+from django.core.management.base import BaseCommand, CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+from restless.models import serialize
+from ... import views
+from ...helpers import compile_fields
+
+
+DEFAULT_VIEWS = ['PeopleList', 'PersonDetail', 'BillList', 'BillDetail']
+
+
+def bench(fn, repeat):
+    return min(timeit.repeat(fn, number=1, repeat=repeat))
+
+
+class Command(BaseCommand):
+    args = '[view ...]'
+    help = ('benchmark the compiled serializers against restless.models.serialize '
+            'using the default fields of the given views')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--rows', type='int', dest='rows', default=100,
+                    help='Number of objects to serialize per view.'),
+        make_option('--repeat', type='int', dest='repeat', default=20,
+                    help='Number of timing runs, the best one is reported.'),
+    )
+
+    def handle(self, *args, **options):
+        for name in (args or DEFAULT_VIEWS):
+            view = getattr(views, name, None)
+            if view is None or not hasattr(view, 'default_fields'):
+                raise CommandError('no such view: {}'.format(name))
+
+            spec = compile_fields(view, view.default_fields)
+            objects = list(spec.apply(view.model.objects.all())[:options['rows']])
+
+            def interpreted():
+                return [serialize(x, **spec.config) for x in objects]
+
+            def compiled():
+                return [spec.serialize(x) for x in objects]
+
+            expected = json.dumps(interpreted(), cls=DjangoJSONEncoder)
+            if json.dumps(compiled(), cls=DjangoJSONEncoder) != expected:
+                raise CommandError('{}: compiled output differs from restless'.format(name))
+
+            before = bench(interpreted, options['repeat'])
+            after = bench(compiled, options['repeat'])
+
+            print('{} ({} objects, {} fields)'.format(name, len(objects),
+                                                       len(view.default_fields)))
+            print('  restless:  {:.6f}s'.format(before))
+            print('  compiled:  {:.6f}s'.format(after))
+            if after:
+                print('  speedup:   {:.2f}x'.format(before / after))
@@ -0,0 +1,61 @@
+from optparse import make_option
+from django.core.management.base import BaseCommand, CommandError
+from ... import views
+from ...helpers import compile_fields, PublicDetailEndpoint
+from ...documents import build_documents, prune_documents
+
+
+def document_views():
+    return sorted(name for name, view in vars(views).items()
+                  if isinstance(view, type) and issubclass(view, PublicDetailEndpoint) and
+                  view.document_store)
+
+
+class Command(BaseCommand):
+    args = '[view ...]'
+    help = ('build the stored documents of the detail views with a document store '
+            '(IMAGO_DOCUMENT_STORE), for the objects that changed since the last run')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--fields', action='append', dest='fields', default=[],
+                    help='Also build documents for this comma separated fields list '
+                    '(repeatable).'),
+        make_option('--batch-size', type='int', dest='batch_size', default=200,
+                    help='Objects per batch.'),
+        make_option('--workers', type='int', dest='workers', default=4,
+                    help='Batches to build at a time.'),
+        make_option('--rebuild', action='store_true', dest='rebuild', default=False,
+                    help='Build every document, not just the stale ones.'),
+    )
+
+    def handle(self, *args, **options):
+        self.verbosity = int(options.get('verbosity', 1))
+        if options['batch_size'] < 1 or options['workers'] < 1:
+            raise CommandError('--batch-size and --workers must be at least 1')
+
+        names = document_views()
+        for name in args:
+            if name not in names:
+                raise CommandError('no document store on: {} (try {})'.format(
+                    name, ', '.join(names)))
+
+        for name in (args or names):
+            view = getattr(views, name)
+            specs = [compile_fields(view, view.default_fields)]
+            try:
+                specs.extend(compile_fields(view, x.split(',')) for x in options['fields'])
+            except KeyError as e:
+                raise CommandError('{}: invalid field {}'.format(name, e))
+
+            for spec in specs:
+                built = build_documents(view, spec, batch_size=options['batch_size'],
+                                        workers=options['workers'],
+                                        rebuild=options['rebuild'], log=self.log)
+                print('{}: {} documents built'.format(name, built))
+            pruned = prune_documents(view, specs)
+            if pruned:
+                print('{}: {} outdated documents deleted'.format(name, pruned))
+
+    def log(self, view, built, total):
+        if self.verbosity > 1:
+            print('{}: {}/{}'.format(view.__name__, built, total))
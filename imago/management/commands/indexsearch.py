@@ -0,0 +1,59 @@
+from optparse import make_option
+from django.core.management.base import BaseCommand, CommandError
+import pyelasticsearch
+from ...indexer import Indexer, INDEXED_VIEWS, get_client, search_index
+
+
+class Command(BaseCommand):
+    args = '[view ...]'
+    help = ('index bills, people, organizations and events into ElasticSearch, '
+            'sending only what changed since the last run')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--host', dest='host', default=None,
+                    help='ElasticSearch URL, instead of ELASTICSEARCH_HOST.'),
+        make_option('--index', dest='index', default=None,
+                    help='Index name, instead of IMAGO_SEARCH_INDEX.'),
+        make_option('--chunk-size', type='int', dest='chunk_size', default=500,
+                    help='Documents per bulk request.'),
+        make_option('--workers', type='int', dest='workers', default=4,
+                    help='Bulk requests to send at a time.'),
+        make_option('--full', action='store_true', dest='full', default=False,
+                    help='Send everything, not just what changed since the last run.'),
+        make_option('--rebuild', action='store_true', dest='rebuild', default=False,
+                    help='Delete the index first (implies --full).'),
+    )
+
+    def handle(self, *args, **options):
+        self.verbosity = int(options.get('verbosity', 1))
+        for name in args:
+            if name not in INDEXED_VIEWS:
+                raise CommandError('can only index: {}'.format(', '.join(INDEXED_VIEWS)))
+        if options['chunk_size'] < 1 or options['workers'] < 1:
+            raise CommandError('--chunk-size and --workers must be at least 1')
+
+        es = get_client(options['host'])
+        index = options['index'] or search_index()
+        if options['rebuild']:
+            try:
+                es.delete_index(index)
+            except pyelasticsearch.ElasticHttpNotFoundError:
+                pass
+
+        indexer = Indexer(es, index, chunk_size=options['chunk_size'],
+                          workers=options['workers'], log=self.log)
+        results = indexer.run(args, full=options['full'] or options['rebuild'])
+
+        failed = 0
+        for doc_type, (sent, errors) in sorted(results.items()):
+            print('{}: {} sent, {} failed'.format(doc_type, sent, len(errors)))
+            for error in errors[:5]:
+                print('  {}: {}'.format(error.get('_id'), error.get('error')))
+            failed += len(errors)
+        if failed:
+            raise CommandError('{} documents failed to index; the next run will '
+                               'retry them'.format(failed))
+
+    def log(self, model, sent):
+        if self.verbosity > 1:
+            print('{}: {}'.format(model._meta.model_name, sent))
@@ -3,25 +3,67 @@ import os
 import csv
 from datetime import datetime
 from optparse import make_option
-from django.db import transaction
+from concurrent.futures import ThreadPoolExecutor
+from django.db import connection, transaction
 from django.core.management.base import BaseCommand, CommandError
 from django.conf import settings
 from ...models import DivisionGeometry
+from ...spatial import notify_mappings_loaded
 from opencivicdata.divisions import Division
 from boundaries.models import BoundarySet
 
 
-def load_mapping(boundary_set_id, key, prefix, boundary_key='external_id', ignore=None, end=None, quiet=False, **kwargs):
+class DivisionIndex(object):
+    """
+    The country's division tree, loaded once and indexed by each of the
+    division attributes the boundary mappings match on (attr key -> value
+    -> ocd id), to be shared between all the boundary sets.
+    """
+
+    def __init__(self, keys, country=None):
+        country = country or settings.IMAGO_COUNTRY
+        self.index = {key: {} for key in keys}
+        for div in Division.get('ocd-division/country:' + country).children(levels=100):
+            for key, mapping in self.index.items():
+                value = div.attrs[key]
+                if value:
+                    mapping[value] = div.id
+
+    def get(self, key, value):
+        return self.index[key].get(value)
+
+
+def stream_boundaries(boundary_set, fields, chunk_size):
+    """
+    Yield `values()` dicts for every boundary in the set, reading them
+    `chunk_size` at a time in id order.
+    """
+    boundaries = boundary_set.boundaries.order_by('id').values('id', 'name', *fields)
+    last = None
+    while True:
+        chunk = boundaries if last is None else boundaries.filter(id__gt=last)
+        chunk = list(chunk[:chunk_size])
+        for boundary in chunk:
+            yield boundary
+        if len(chunk) < chunk_size:
+            return
+        last = chunk[-1]['id']
+
+
+def load_mapping(boundary_set_id, key, prefix, boundary_key='external_id', ignore=None,
+                 end=None, quiet=False, divisions=None, chunk_size=1000, **kwargs):
+    """
+    Work out the (division_id, boundary_id) pairs that should exist for a
+    boundary set. Pass a `DivisionIndex` as `divisions` to avoid walking
+    the division tree again.
+    """
     if ignore:
         ignore = re.compile(ignore)
     ignored = 0
-    geoid_mapping = {}
+    if divisions is None:
+        divisions = DivisionIndex([key])
 
-    division_geometries = []
-
-    for div in Division.get('ocd-division/country:' + settings.IMAGO_COUNTRY).children(levels=100):
-        if div.attrs[key]:
-            geoid_mapping[div.attrs[key]] = div.id
+    division_geometries = set()
 
     print('processing', boundary_set_id)
 
@@ -30,26 +72,75 @@ def load_mapping(boundary_set_id, key, prefix, boundary_key='external_id', ignor
         fields = []
     else:
         fields = [boundary_key]
-    for boundary in boundary_set.boundaries.values('id', 'name', *fields):
+    for boundary in stream_boundaries(boundary_set, fields, chunk_size):
         if callable(boundary_key):
             boundary_property = boundary_key(boundary)
         else:
             boundary_property = boundary[boundary_key]
-        ocd_id = geoid_mapping.get(prefix + boundary_property)
+        ocd_id = divisions.get(key, prefix + boundary_property)
         if ocd_id:
-            division_geometries.append(DivisionGeometry(division_id=ocd_id,
-                                                        boundary_id=boundary['id']))
+            division_geometries.add((ocd_id, boundary['id']))
         elif not ignore or not ignore.match(boundary['name']):
             if not quiet:
                 print('unmatched external id', boundary['name'], boundary_property)
         else:
             ignored += 1
 
-    DivisionGeometry.objects.bulk_create(division_geometries)
-
     if ignored:
         print('ignored {} unmatched external ids'.format(ignored))
 
+    return division_geometries
+
+
+def load_mappings(mappings, workers, quiet=False, chunk_size=1000):
+    """
+    Run `load_mapping` for every boundary set in a pool of `workers`
+    threads, all sharing one `DivisionIndex`. This only reads, so callers
+    are free to write the results from their own transaction. Yields
+    (boundary set id, pairs) in the order of `mappings`.
+    """
+    divisions = DivisionIndex({d['key'] for d in mappings.values()})
+
+    def work(item):
+        set_id, d = item
+        try:
+            return set_id, load_mapping(set_id, quiet=quiet, divisions=divisions,
+                                        chunk_size=chunk_size, **d)
+        finally:
+            # Each worker thread has its own connection.
+            connection.close()
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for result in pool.map(work, mappings.items()):
+            yield result
+
+
+def apply_mapping(boundary_set_id, division_geometries, batch_size):
+    """
+    Bring the DivisionGeometry rows for a boundary set in line with the
+    wanted (division_id, boundary_id) pairs, only inserting and deleting
+    the difference. Returns the number of rows added and removed.
+    """
+    existing = set()
+    stale = []
+    rows = DivisionGeometry.objects.filter(boundary__set_id=boundary_set_id)
+    for id_, division_id, boundary_id in rows.values_list('id', 'division_id', 'boundary_id'):
+        pair = (division_id, boundary_id)
+        if pair in division_geometries and pair not in existing:
+            existing.add(pair)
+        else:
+            stale.append(id_)
+
+    for i in range(0, len(stale), batch_size):
+        DivisionGeometry.objects.filter(id__in=stale[i:i + batch_size]).delete()
+
+    DivisionGeometry.objects.bulk_create([
+        DivisionGeometry(division_id=division_id, boundary_id=boundary_id)
+        for division_id, boundary_id in sorted(division_geometries - existing)
+    ], batch_size=batch_size)
+
+    return len(division_geometries - existing), len(stale)
+
 
 class Command(BaseCommand):
     help = 'load in division-boundary mappings'
@@ -57,11 +148,46 @@ class Command(BaseCommand):
     option_list = BaseCommand.option_list + (
         make_option('--quiet', action='store_true', dest='quiet',
                     default=False, help='Be somewhat quiet.'),
+        make_option('--incremental', action='store_true', dest='incremental',
+                    default=False, help='Only insert and delete the mappings '
+                    'that changed, one boundary set at a time, rather than '
+                    'reloading them all in one transaction.'),
+        make_option('--batch-size', type='int', dest='batch_size', default=1000,
+                    help='Rows per bulk insert or delete, and per read of boundaries.'),
+        make_option('--workers', type='int', dest='workers', default=4,
+                    help='Number of boundary sets to match at once.'),
     )
 
 
     def handle(self, *args, **options):
-        with transaction.atomic():
-            DivisionGeometry.objects.all().delete()
-            for set_id, d in settings.IMAGO_BOUNDARY_MAPPINGS.items():
-                load_mapping(set_id, quiet=options['quiet'], **d)
+        mappings = settings.IMAGO_BOUNDARY_MAPPINGS
+        batch_size = options['batch_size']
+
+        if options['incremental']:
+            with transaction.atomic():
+                orphans = DivisionGeometry.objects.exclude(
+                    boundary__set_id__in=list(mappings.keys()))
+                count = orphans.count()
+                orphans.delete()
+            if count:
+                print('removed {} mappings from unconfigured boundary sets'.format(count))
+
+            for set_id, division_geometries in load_mappings(
+                    mappings, options['workers'], quiet=options['quiet'],
+                    chunk_size=batch_size):
+                with transaction.atomic():
+                    added, removed = apply_mapping(set_id, division_geometries, batch_size)
+                print('{}: {} added, {} removed, {} unchanged'.format(
+                    set_id, added, removed, len(division_geometries) - added))
+        else:
+            with transaction.atomic():
+                DivisionGeometry.objects.all().delete()
+                for set_id, division_geometries in load_mappings(
+                        mappings, options['workers'], quiet=options['quiet'],
+                        chunk_size=batch_size):
+                    DivisionGeometry.objects.bulk_create([
+                        DivisionGeometry(division_id=division_id, boundary_id=boundary_id)
+                        for division_id, boundary_id in division_geometries
+                    ], batch_size=batch_size)
+
+        notify_mappings_loaded()
@@ -0,0 +1,209 @@
+# Copyright (c) Sunlight Foundation, 2014, under the BSD-3 License.
+
+from django.conf import settings
+from django.http import HttpResponse, Http404
+from collections import defaultdict
+
+from .queries import QueryCounter
+
+import threading
+import bisect
+import time
+
+"""
+Opt-in, in-process metrics for the API views, in the Prometheus text
+format.
+
+With `IMAGO_METRICS` on, every request to a public endpoint updates
+per-view counters and histograms (latency, time per phase, DB queries and
+time, rows serialized and response size), and `/metrics/` serves them.
+
+Each thread records into its own shard, so the request path never takes a
+lock (except once, when a thread first records anything); a scrape adds
+the shards up. The numbers are per process, so with several WSGI worker
+processes, scrape each of them.
+"""
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+SECONDS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERIES = (1, 2, 3, 5, 8, 13, 21, 34, 55, 89, 144)
+ROWS = (0, 1, 5, 10, 25, 50, 100, 250, 500)
+BYTES = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+
+def metrics_enabled():
+    return getattr(settings, 'IMAGO_METRICS', False)
+
+
+class Shard(object):
+    """
+    One thread's share of the metrics. Only its own thread writes to it.
+    """
+
+    def __init__(self):
+        self.counters = defaultdict(float)
+        self.histograms = {}
+
+
+class Registry(object):
+
+    def __init__(self):
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.shards = []
+        self.metrics = {}
+
+    def counter(self, name, help):
+        self.metrics[name] = ('counter', help, None)
+
+    def histogram(self, name, help, buckets):
+        self.metrics[name] = ('histogram', help, tuple(buckets))
+
+    def shard(self):
+        shard = getattr(self.local, 'shard', None)
+        if shard is None:
+            shard = self.local.shard = Shard()
+            with self.lock:
+                self.shards.append(shard)
+        return shard
+
+    def inc(self, name, labels, value=1):
+        self.shard().counters[(name, labels)] += value
+
+    def observe(self, name, labels, value):
+        """
+        Record `value` in a histogram. Each bucket is counted on its own
+        (the cumulative counts are worked out when rendering), followed by
+        the sum and the count.
+        """
+        buckets = self.metrics[name][2]
+        histograms = self.shard().histograms
+        values = histograms.get((name, labels))
+        if values is None:
+            values = histograms[(name, labels)] = [0] * (len(buckets) + 3)
+        values[bisect.bisect_left(buckets, value)] += 1
+        values[-2] += value
+        values[-1] += 1
+
+    def collect(self):
+        """
+        Add up the shards, returning ({(name, labels): value},
+        {(name, labels): [bucket counts..., sum, count]}).
+        """
+        counters = defaultdict(float)
+        histograms = {}
+        with self.lock:
+            shards = list(self.shards)
+        for shard in shards:
+            for key, value in list(shard.counters.items()):
+                counters[key] += value
+            for key, values in list(shard.histograms.items()):
+                total = histograms.setdefault(key, [0] * len(values))
+                for i, value in enumerate(list(values)):
+                    total[i] += value
+        return counters, histograms
+
+    def render(self):
+        """
+        Everything recorded so far, in the Prometheus text format.
+        """
+        counters, histograms = self.collect()
+        lines = []
+        for name in sorted(self.metrics):
+            kind, help, buckets = self.metrics[name]
+            lines.append("# HELP %s %s" % (name, help))
+            lines.append("# TYPE %s %s" % (name, kind))
+            if kind == 'counter':
+                for (metric, labels), value in sorted(counters.items()):
+                    if metric == name:
+                        lines.append("%s%s %s" % (name, format_labels(labels),
+                                                  format_value(value)))
+                continue
+
+            for (metric, labels), values in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(buckets + ('+Inf',), values):
+                    cumulative += count
+                    lines.append("%s_bucket%s %s" % (
+                        name, format_labels(labels + (('le', format_value(bound)),)),
+                        cumulative))
+                lines.append("%s_sum%s %s" % (name, format_labels(labels),
+                                              format_value(values[-2])))
+                lines.append("%s_count%s %s" % (name, format_labels(labels),
+                                                values[-1]))
+        return "\n".join(lines) + "\n"
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{%s}" % (",".join('%s="%s"' % (
+        key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in labels))
+
+
+def format_value(value):
+    if isinstance(value, str):
+        return value
+    if value == int(value):
+        return str(int(value))
+    return repr(float(value))
+
+
+registry = Registry()
+registry.counter('imago_requests_total', "Requests, by view and status.")
+registry.histogram('imago_request_duration_seconds', "Time spent in the view.", SECONDS)
+registry.histogram('imago_phase_duration_seconds',
+                   "Time spent per request in each phase (see imago.timing).", SECONDS)
+registry.histogram('imago_db_queries', "Database queries per request.", QUERIES)
+registry.histogram('imago_db_duration_seconds', "Database time per request.", SECONDS)
+registry.histogram('imago_rows_serialized', "Objects serialized per request.", ROWS)
+registry.histogram('imago_response_bytes', "Response body size.", BYTES)
+
+
+class MetricsMixin(object):
+    """
+    Records the metrics for every request to the view, when `IMAGO_METRICS`
+    is on. Like `TimingMixin`, this has to come before the restless
+    endpoint in the bases. Views set `self.rows_serialized`.
+    """
+
+    rows_serialized = 0
+
+    def dispatch(self, request, *args, **kwargs):
+        if not metrics_enabled():
+            return super(MetricsMixin, self).dispatch(request, *args, **kwargs)
+
+        start = time.perf_counter()
+        with QueryCounter() as queries:
+            response = super(MetricsMixin, self).dispatch(request, *args, **kwargs)
+        elapsed = time.perf_counter() - start
+
+        view = (('view', type(self).__name__),)
+        registry.inc('imago_requests_total', view + (('status', response.status_code),))
+        registry.observe('imago_request_duration_seconds', view, elapsed)
+        registry.observe('imago_db_queries', view, queries.count)
+        registry.observe('imago_db_duration_seconds', view, queries.time)
+        registry.observe('imago_rows_serialized', view, self.rows_serialized)
+        if not response.streaming:
+            registry.observe('imago_response_bytes', view, len(response.content))
+
+        timer = getattr(self, 'timer', None)
+        if timer is not None:
+            for phase, seconds in list(timer.phases.items()):
+                registry.observe('imago_phase_duration_seconds',
+                                 view + (('phase', phase),), seconds)
+        return response
+
+
+def metrics(request):
+    """
+    The metrics, for Prometheus to scrape. This is a 404 unless
+    `IMAGO_METRICS` is on.
+    """
+    if not metrics_enabled():
+        raise Http404("metrics are disabled")
+    return HttpResponse(registry.render(), content_type=CONTENT_TYPE)
@@ -10,3 +10,23 @@ class DivisionGeometry(models.Model):
 
     def __unicode__(self):
         return '{0} - {1} - {2}'.format(self.division, self.boundary)
+
+
+class SerializedDocument(models.Model):
+    """
+    A detail view's rendered JSON for one object and field spec, built by
+    the `builddocuments` command. It's fresh while `updated_at` matches the
+    object's (see imago.documents).
+    """
+    view = models.CharField(max_length=100)
+    object_id = models.CharField(max_length=300)
+    spec = models.CharField(max_length=40)
+    updated_at = models.DateTimeField()
+    content = models.TextField()
+
+    class Meta:
+        unique_together = (('object_id', 'spec'),)
+        index_together = (('view', 'spec'),)
+
+    def __unicode__(self):
+        return '{0} - {1}'.format(self.object_id, self.spec)
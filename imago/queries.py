@@ -0,0 +1,214 @@
+# Copyright (c) Sunlight Foundation, 2014, under the BSD-3 License.
+
+from django.conf import settings
+from django.db import connections
+from collections import OrderedDict
+
+import threading
+import logging
+import time
+import re
+
+"""
+Per-request query checks.
+
+Queries are grouped by their SQL with the literal values taken out, so
+that the same query run once per row -- a serialize lambda doing its own
+lookup, or a relation that should have been prefetched -- shows up as one
+group with a big count: an N+1.
+
+Endpoints can also declare a `max_queries` budget. It covers requests for
+the view's `default_fields` (other `fields` cost what they cost), and is
+there to stop changes to the defaults or the serialize configs from
+quietly adding queries.
+
+The checks run when `IMAGO_QUERY_CHECKS` is on (it follows `DEBUG` by
+default). Problems are logged to the `imago.queries` logger, or, with
+`IMAGO_QUERY_CHECK_ACTION = 'raise'` (for tests), raise
+`QueryBudgetExceeded`.
+
+Queries are counted with `QueryCounter`, which wraps the cursors of the
+current thread's connections rather than turning on Django's debug cursor
+(as `CaptureQueriesContext` does), so it's safe to use in production under
+a multi-threaded server.
+"""
+
+logger = logging.getLogger(__name__)
+
+STRINGS = re.compile(r"'(?:[^']|'')*'")
+PLACEHOLDERS = re.compile(r"%s")
+NUMBERS = re.compile(r"\b\d+(?:\.\d+)?\b")
+IN_LISTS = re.compile(r"\bIN \((?:\?, )*\?\)", re.IGNORECASE)
+SPACES = re.compile(r"\s+")
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+_local = threading.local()
+
+
+class CountingCursor(object):
+    """
+    A cursor reporting every query it runs to the thread's active
+    `QueryCounter`s.
+    """
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    def __enter__(self):
+        self.cursor.__enter__()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        return self.cursor.__exit__(type, value, traceback)
+
+    def run(self, method, sql, *args):
+        start = time.perf_counter()
+        try:
+            return method(sql, *args)
+        finally:
+            elapsed = time.perf_counter() - start
+            for counter in getattr(_local, 'counters', ()):
+                counter.add(sql, elapsed)
+
+    def execute(self, sql, params=None):
+        return self.run(self.cursor.execute, sql, params)
+
+    def executemany(self, sql, param_list):
+        return self.run(self.cursor.executemany, sql, param_list)
+
+
+def count_queries_on(connection):
+    """
+    Make `connection` (this thread's wrapper for it) hand out
+    `CountingCursor`s. Only needs doing once.
+    """
+    if getattr(connection, 'counting_queries', False):
+        return
+    cursor = connection.cursor
+    connection.cursor = lambda: CountingCursor(cursor())
+    connection.counting_queries = True
+
+
+class QueryCounter(object):
+    """
+    Counts the queries this thread runs, on any connection, and the time
+    they take, while it's active. With `record`, the SQL of each is kept
+    too, as `connection.queries` style dicts (with placeholders rather
+    than values).
+    """
+
+    def __init__(self, record=False):
+        self.record = record
+        self.count = 0
+        self.time = 0.0
+        self.queries = []
+
+    def add(self, sql, elapsed):
+        self.count += 1
+        self.time += elapsed
+        if self.record:
+            self.queries.append({"sql": sql, "time": elapsed})
+
+    def __enter__(self):
+        for connection in connections.all():
+            count_queries_on(connection)
+        counters = getattr(_local, 'counters', None)
+        if counters is None:
+            counters = _local.counters = []
+        counters.append(self)
+        return self
+
+    def __exit__(self, type, value, traceback):
+        _local.counters.remove(self)
+
+
+def normalize_sql(sql):
+    """
+    Reduce a query to its template, replacing literals (and `%s`
+    placeholders) with `?` and
+    `IN (...)` lists of any length with `IN (...)`.
+    """
+    sql = STRINGS.sub("?", sql)
+    sql = PLACEHOLDERS.sub("?", sql)
+    sql = NUMBERS.sub("?", sql)
+    sql = IN_LISTS.sub("IN (...)", sql)
+    return SPACES.sub(" ", sql).strip()
+
+
+def group_queries(queries):
+    """
+    Group `connection.queries` style dicts by their normalized SQL,
+    returning a list of {"sql", "count", "time"} dicts, most repeated first.
+    """
+    groups = OrderedDict()
+    for query in queries:
+        sql = normalize_sql(query['sql'])
+        group = groups.setdefault(sql, {"sql": sql, "count": 0, "time": 0.0})
+        group['count'] += 1
+        group['time'] += float(query['time'])
+    return sorted(groups.values(), key=lambda x: x['count'], reverse=True)
+
+
+def repeated_queries(groups):
+    """
+    The groups run often enough to look like an N+1.
+    """
+    threshold = getattr(settings, 'IMAGO_N_PLUS_ONE_THRESHOLD', 5)
+    return [x for x in groups if x['count'] >= threshold]
+
+
+def query_checks_enabled():
+    return getattr(settings, 'IMAGO_QUERY_CHECKS', settings.DEBUG)
+
+
+class QueryBudgetMixin(object):
+    """
+    Runs the query checks around every request to the view. Like
+    `TimingMixin`, this has to come before the restless endpoint in the
+    bases.
+
+         - max_queries | The most queries a request for the view's
+                       | `default_fields` may make, or None.
+    """
+
+    max_queries = None
+
+    def dispatch(self, request, *args, **kwargs):
+        if not query_checks_enabled():
+            return super(QueryBudgetMixin, self).dispatch(request, *args, **kwargs)
+
+        with QueryCounter(record=True) as queries:
+            response = super(QueryBudgetMixin, self).dispatch(request, *args, **kwargs)
+        # Streamed responses keep querying after we return.
+        if not response.streaming:
+            self.check_queries(request, queries.queries)
+        return response
+
+    def check_queries(self, request, queries):
+        problems = []
+        for group in repeated_queries(group_queries(queries)):
+            problems.append("possible N+1, ran {count} times: {sql}".format(**group))
+
+        if (self.max_queries is not None and 'fields' not in request.GET and
+                len(queries) > self.max_queries):
+            problems.append("{} queries, over the budget of {}".format(
+                len(queries), self.max_queries))
+
+        if not problems:
+            return
+
+        message = "{} {}: {}".format(type(self).__name__, request.get_full_path(),
+                                     "; ".join(problems))
+        if getattr(settings, 'IMAGO_QUERY_CHECK_ACTION', 'log') == 'raise':
+            raise QueryBudgetExceeded(message)
+        logger.warning(message)
@@ -0,0 +1,125 @@
+# Copyright (c) Sunlight Foundation, 2014, under the BSD-3 License.
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse
+from django.utils.module_loading import import_string
+
+import datetime
+import decimal
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+"""
+JSON rendering for API responses.
+
+restless' `Http200` always encodes with the standard library and
+`DjangoJSONEncoder`. Here the encoder is pluggable through
+`IMAGO_JSON_RENDERER`:
+
+    - 'auto' (the default) uses orjson if it's installed, and the standard
+      library otherwise.
+    - 'orjson' or 'json' pick one.
+    - anything else is a dotted path to a function taking the data and
+      returning the encoded bytes.
+
+Every renderer encodes datetimes, dates, times and Decimals the way
+`DjangoJSONEncoder` does, so the decoded documents are identical; only
+insignificant whitespace and string escaping may differ. If a fast encoder
+can't handle some value, that response falls back to the standard one.
+"""
+
+CONTENT_TYPE = 'application/json; charset=utf-8'
+
+
+def encode_default(o):
+    """
+    `DjangoJSONEncoder.default`, as a plain function for the encoders that
+    take a `default` hook.
+    """
+    if isinstance(o, datetime.datetime):
+        r = o.isoformat()
+        if o.microsecond:
+            r = r[:23] + r[26:]
+        if r.endswith('+00:00'):
+            r = r[:-6] + 'Z'
+        return r
+    elif isinstance(o, datetime.date):
+        return o.isoformat()
+    elif isinstance(o, datetime.time):
+        if o.utcoffset() is not None:
+            raise ValueError("JSON can't represent timezone-aware times.")
+        r = o.isoformat()
+        if o.microsecond:
+            r = r[:12]
+        return r
+    elif isinstance(o, decimal.Decimal):
+        return str(o)
+    raise TypeError("%r is not JSON serializable" % (o,))
+
+
+def render_json(data):
+    return json.dumps(data, cls=DjangoJSONEncoder).encode('utf-8')
+
+
+def render_orjson(data):
+    try:
+        # orjson's own datetime format differs from Django's, so those go
+        # through `encode_default` too.
+        return orjson.dumps(data, default=encode_default,
+                            option=orjson.OPT_PASSTHROUGH_DATETIME)
+    except TypeError:
+        return render_json(data)
+
+
+def _load_renderer(name):
+    if name == 'json':
+        return render_json
+    if name in ('orjson', 'auto'):
+        if orjson is None:
+            if name == 'orjson':
+                raise ImproperlyConfigured("IMAGO_JSON_RENDERER is 'orjson', "
+                                           "but orjson isn't installed")
+            return render_json
+        return render_orjson
+    try:
+        return import_string(name)
+    except ImportError as e:
+        raise ImproperlyConfigured("Can't import IMAGO_JSON_RENDERER %s: %s" % (name, e))
+
+
+_renderers = {}
+
+
+def get_renderer(name=None):
+    """
+    The renderer function named by `name`, or by `IMAGO_JSON_RENDERER`.
+    """
+    if name is None:
+        name = getattr(settings, 'IMAGO_JSON_RENDERER', 'auto')
+    renderer = _renderers.get(name)
+    if renderer is None:
+        renderer = _renderers[name] = _load_renderer(name)
+    return renderer
+
+
+def render(data):
+    """
+    Encode `data` as JSON bytes with the configured renderer.
+    """
+    return get_renderer()(data)
+
+
+class JSONResponse(HttpResponse):
+    """
+    A 200 with `data` rendered as JSON; the drop-in for restless' `Http200`.
+    """
+
+    def __init__(self, data, **kwargs):
+        kwargs['content_type'] = CONTENT_TYPE
+        super(JSONResponse, self).__init__(render(data), **kwargs)
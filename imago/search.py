@@ -0,0 +1,112 @@
+# Copyright (c) Sunlight Foundation, 2014, under the BSD-3 License.
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections
+from django.utils.module_loading import import_string
+
+"""
+Search backends for the `q=` parameter on list endpoints.
+
+A backend takes a query set, the text to look for and the view's
+`search_fields`, and returns the query set narrowed down to the matches,
+with a `search_rank` column and ordered by it (best first). Everything
+after that -- sorting, pagination, `fields` -- works as usual.
+
+`IMAGO_SEARCH_BACKEND` is the dotted path of the backend class:
+
+    - `imago.search.PostgresSearchBackend` (the default) uses Postgres
+      full-text search, with the `IMAGO_SEARCH_CONFIG` text search
+      configuration (default 'english').
+    - `imago.search.TrigramSearchBackend` ranks by trigram similarity,
+      which copes with typos and partial names; it needs the `pg_trgm`
+      extension.
+    - `imago.search.ElasticSearchBackend` asks ElasticSearch (through the
+      `imago.core` client) for the best `IMAGO_SEARCH_MAX_RESULTS` matches
+      in `IMAGO_SEARCH_INDEX`, with one document type per model.
+"""
+
+
+class SearchBackend(object):
+
+    def search(self, queryset, query, fields):
+        raise NotImplementedError
+
+
+def _columns(queryset, fields):
+    model = queryset.model
+    qn = connections[queryset.db].ops.quote_name
+    return ["%s.%s" % (qn(model._meta.db_table), qn(model._meta.get_field(x).column))
+            for x in fields]
+
+
+class PostgresSearchBackend(SearchBackend):
+
+    def search(self, queryset, query, fields):
+        config = getattr(settings, 'IMAGO_SEARCH_CONFIG', 'english')
+        document = " || ' ' || ".join("coalesce(%s, '')" % (x)
+                                      for x in _columns(queryset, fields))
+        vector = "to_tsvector(%%s, %s)" % (document)
+        return queryset.extra(
+            select={'search_rank': "ts_rank(%s, plainto_tsquery(%%s, %%s))" % (vector)},
+            select_params=[config, config, query],
+            where=["%s @@ plainto_tsquery(%%s, %%s)" % (vector)],
+            params=[config, config, query],
+        ).order_by('-search_rank', 'id')
+
+
+class TrigramSearchBackend(SearchBackend):
+
+    def search(self, queryset, query, fields):
+        columns = _columns(queryset, fields)
+        rank = "greatest(%s)" % (", ".join("similarity(%s, %%s)" % (x) for x in columns))
+        return queryset.extra(
+            select={'search_rank': rank},
+            select_params=[query] * len(columns),
+            # `%%` is pg_trgm's similarity operator, escaped.
+            where=["(%s)" % (" OR ".join("%s %%%% %%s" % (x) for x in columns))],
+            params=[query] * len(columns),
+        ).order_by('-search_rank', 'id')
+
+
+class ElasticSearchBackend(SearchBackend):
+
+    def search(self, queryset, query, fields):
+        try:
+            from .core import elasticsearch
+        except ImportError:
+            raise ImproperlyConfigured("ElasticSearchBackend needs ENABLE_ELASTICSEARCH")
+
+        result = elasticsearch.search(
+            {"query": {"multi_match": {"query": query, "fields": list(fields)}},
+             "_source": False},
+            index=getattr(settings, 'IMAGO_SEARCH_INDEX', 'imago'),
+            doc_type=queryset.model._meta.model_name,
+            size=getattr(settings, 'IMAGO_SEARCH_MAX_RESULTS', 1000),
+        )
+        ids = [hit['_id'] for hit in result['hits']['hits']]
+        if not ids:
+            return queryset.none()
+
+        # Keep ElasticSearch's order: the best hit gets the highest rank.
+        qn = connections[queryset.db].ops.quote_name
+        column = "%s.%s" % (qn(queryset.model._meta.db_table),
+                            qn(queryset.model._meta.pk.column))
+        rank = "CASE %s %s END" % (column, " ".join(["WHEN %s THEN %s"] * len(ids)))
+        params = []
+        for i, id_ in enumerate(ids):
+            params.extend([id_, len(ids) - i])
+        return queryset.filter(pk__in=ids).extra(
+            select={'search_rank': rank}, select_params=params,
+        ).order_by('-search_rank', 'id')
+
+
+_backend = {}
+
+
+def get_search_backend():
+    path = getattr(settings, 'IMAGO_SEARCH_BACKEND', 'imago.search.PostgresSearchBackend')
+    backend = _backend.get(path)
+    if backend is None:
+        backend = _backend[path] = import_string(path)()
+    return backend
@@ -3,8 +3,11 @@
 #    - Paul R. Tagliamonte <paultag@sunlightfoundation.com>
 
 import copy
-import pytz
+import operator
+import functools
+from collections import defaultdict
 from opencivicdata.models import Division
+from .models import DivisionGeometry
 
 """
 The following specs in this file are used to limit exactly what we can
@@ -31,7 +34,11 @@ def dout(obj):
     """
     if obj is None:
         return
-    return pytz.UTC.localize(obj).isoformat()
+    if obj.tzinfo is not None:
+        raise ValueError('Not naive datetime (tzinfo is already set)')
+    # Same as pytz.UTC.localize(obj).isoformat(), without building an
+    # aware datetime for every value.
+    return obj.isoformat() + '+00:00'
 
 
 def sfilter(obj, blacklist):
@@ -44,6 +51,38 @@ def sfilter(obj, blacklist):
     return ret
 
 
+class BatchedField(object):
+    """
+    A serialize callable which can also load its data for a whole page of
+    objects at once.
+
+    `fn(obj)` works out the value for one object. `load_many(objs)` returns
+    a mapping of pk to that same value for every object in `objs`, ideally
+    in a fixed number of queries. Once `preload` has been run on a page
+    (`imago.helpers.FieldSpec.preload` does this for every request),
+    calling the field is just a lookup; objects that weren't preloaded fall
+    back to `fn`.
+    """
+
+    def __init__(self, fn, load_many):
+        self.fn = fn
+        self.load_many = load_many
+        self.cache_name = '_imago_batched_%s' % (id(self))
+
+    def preload(self, objs):
+        if not objs:
+            return
+        values = self.load_many(objs)
+        for obj in objs:
+            setattr(obj, self.cache_name, values[obj.pk])
+
+    def __call__(self, obj):
+        try:
+            return getattr(obj, self.cache_name)
+        except AttributeError:
+            return self.fn(obj)
+
+
 DIVISION_SERIALIZE = dict([("id", {}), ("name", {})])
 SOURCES_SERIALIZE = {"note": {}, "url": {},}
 
@@ -358,13 +397,50 @@ def boundary_to_dict(boundary):
     return d
 
 
+def division_children(division):
+    return [{'id': d.id, 'name': d.name}
+            for d in Division.objects.children_of(division.id).only('id', 'name')]
+
+
+def division_children_many(divisions):
+    """
+    Children of every division in `divisions`, in one query.
+    """
+    children = defaultdict(list)
+    query = functools.reduce(operator.or_, (Division.objects.children_of(d.id)
+                                            for d in divisions))
+    for child in query.only('id', 'name'):
+        # Children are exactly one level down, so the parent id is the
+        # child's with the last type:id pair chopped off.
+        children[child.id.rsplit('/', 1)[0]].append({'id': child.id,
+                                                     'name': child.name})
+    return children
+
+
+def division_geometries(division):
+    return [boundary_to_dict(dg.boundary)
+            for dg in division.geometries.select_related('boundary__set')]
+
+
+def division_geometries_many(divisions):
+    """
+    Geometries of every division in `divisions`, with their boundaries and
+    boundary sets JOINed in, in one query.
+    """
+    geometries = defaultdict(list)
+    query = DivisionGeometry.objects.filter(
+        division_id__in=[d.id for d in divisions]
+    ).select_related('boundary__set')
+    for dg in query:
+        geometries[dg.division_id].append(boundary_to_dict(dg.boundary))
+    return geometries
+
+
 DIVISION_SERIALIZE = {
     'id': {},
     'name': {},
     'country': {},
     'jurisdictions': JURISDICTION_SERIALIZE,
-    'children': lambda division: [{'id': d.id, 'name': d.name}
-                                   for d in Division.objects.children_of(division.id)],
-    'geometries': lambda division: [boundary_to_dict(dg.boundary)
-                                    for dg in division.geometries.all()]
+    'children': BatchedField(division_children, division_children_many),
+    'geometries': BatchedField(division_geometries, division_geometries_many),
 }
@@ -0,0 +1,177 @@
+# Copyright (c) Sunlight Foundation, 2014, under the BSD-3 License.
+
+from django.conf import settings
+from django.contrib.gis.geos import Point
+from django.core.cache import cache
+from django.dispatch import Signal
+
+import threading
+import math
+import time
+
+"""
+An optional in-process replacement for the PostGIS `shape__contains` join
+behind the `lat` / `lon` filters.
+
+When `IMAGO_POINT_INDEX` is on, every DivisionGeometry's boundary shape is
+loaded once into a packed R-tree of bounding boxes. A point lookup walks
+the tree for the few boxes containing the point, then runs an exact
+(prepared geometry) containment test on those, and the views filter by
+`id__in` on the resulting division ids.
+
+The index is rebuilt when `loadmappings` runs: in-process through the
+`mappings_loaded` signal, and in other processes (the web workers) by
+noticing the version stamp in the Django cache has changed, which is
+checked at most every `IMAGO_POINT_INDEX_CHECK_INTERVAL` seconds.
+"""
+
+mappings_loaded = Signal()
+
+VERSION_KEY = 'imago:point-index-version'
+NODE_CAPACITY = 16
+
+
+def _union(boxes):
+    xmins, ymins, xmaxs, ymaxs = zip(*boxes)
+    return (min(xmins), min(ymins), max(xmaxs), max(ymaxs))
+
+
+def _pack(entries, leaf):
+    """
+    Sort-Tile-Recursive packing of one level of the tree: tile `entries`
+    (pairs of bounding box and payload) into vertical slices by x, then
+    group each slice into nodes by y.
+    """
+    nodes = []
+    count = int(math.ceil(len(entries) / float(NODE_CAPACITY)))
+    per_slice = int(math.ceil(math.sqrt(count))) * NODE_CAPACITY
+
+    entries = sorted(entries, key=lambda e: e[0][0] + e[0][2])
+    for i in range(0, len(entries), per_slice):
+        tile = sorted(entries[i:i + per_slice], key=lambda e: e[0][1] + e[0][3])
+        for j in range(0, len(tile), NODE_CAPACITY):
+            children = tile[j:j + NODE_CAPACITY]
+            nodes.append((_union([x[0] for x in children]), (leaf, children)))
+    return nodes
+
+
+class RTree(object):
+    """
+    A static, bulk loaded R-tree of (bounding box, payload) pairs, where a
+    bounding box is (xmin, ymin, xmax, ymax).
+    """
+
+    def __init__(self, entries):
+        self.size = len(entries)
+        self.root = None
+        if entries:
+            nodes = _pack(entries, leaf=True)
+            while len(nodes) > 1:
+                nodes = _pack(nodes, leaf=False)
+            self.root = nodes[0]
+
+    def search(self, x, y):
+        """
+        Yield the payload of every box containing the point (x, y).
+        """
+        if self.root is None:
+            return
+        stack = [self.root]
+        while stack:
+            (xmin, ymin, xmax, ymax), (leaf, children) = stack.pop()
+            if not (xmin <= x <= xmax and ymin <= y <= ymax):
+                continue
+            if not leaf:
+                stack.extend(children)
+                continue
+            for (xmin, ymin, xmax, ymax), payload in children:
+                if xmin <= x <= xmax and ymin <= y <= ymax:
+                    yield payload
+
+
+class PointIndex(object):
+    """
+    Resolves a point to the ids of the divisions whose geometries contain
+    it, from memory.
+    """
+
+    def __init__(self):
+        self.tree = None
+        self.version = None
+        self.checked = 0
+        self.lock = threading.Lock()
+
+    def load(self):
+        from .models import DivisionGeometry
+
+        version = cache.get(VERSION_KEY)
+        entries = []
+        query = DivisionGeometry.objects.select_related('boundary').only(
+            'division', 'boundary', 'boundary__shape')
+        for dg in query.iterator():
+            shape = dg.boundary.shape
+            if shape is None or shape.empty:
+                continue
+            entries.append((shape.extent, (dg.division_id, shape.prepared)))
+
+        self.tree = RTree(entries)
+        self.version = version
+        self.checked = time.time()
+
+    def ensure_current(self):
+        interval = getattr(settings, 'IMAGO_POINT_INDEX_CHECK_INTERVAL', 60)
+        if self.tree is not None and time.time() - self.checked < interval:
+            return
+
+        with self.lock:
+            if self.tree is None:
+                self.load()
+            elif time.time() - self.checked >= interval:
+                if cache.get(VERSION_KEY) != self.version:
+                    self.load()
+                self.checked = time.time()
+
+    def lookup(self, lon, lat):
+        """
+        Return the set of division ids containing the point.
+        """
+        self.ensure_current()
+        point = Point(lon, lat, srid=4326)
+        return {division_id for division_id, shape in self.tree.search(lon, lat)
+                if shape.contains(point)}
+
+
+point_index = PointIndex()
+
+
+def point_filter(lat, lon, prefix=''):
+    """
+    Return the filter kwargs restricting a query set to divisions (or,
+    with `prefix`, objects related to divisions) containing the point.
+
+    This uses the in-memory index if `IMAGO_POINT_INDEX` is on, otherwise
+    it's the PostGIS `contains` lookup.
+    """
+    if not getattr(settings, 'IMAGO_POINT_INDEX', False):
+        return {prefix + 'geometries__boundary__shape__contains':
+                'POINT({} {})'.format(lon, lat)}
+
+    ids = point_index.lookup(float(lon), float(lat))
+    return {prefix + 'id__in': sorted(ids)}
+
+
+def notify_mappings_loaded():
+    """
+    Tell every process holding a point index that the division-boundary
+    mappings changed, and it needs to reload.
+    """
+    cache.set(VERSION_KEY, time.time(), None)
+    mappings_loaded.send(sender=PointIndex)
+
+
+def _reload(sender, **kwargs):
+    if point_index.tree is not None:
+        with point_index.lock:
+            point_index.load()
+
+mappings_loaded.connect(_reload)
@@ -0,0 +1,78 @@
+# Copyright (c) Sunlight Foundation, 2014, under the BSD-3 License.
+
+from django.conf import settings
+from collections import OrderedDict
+
+import contextlib
+import time
+
+"""
+Always-on, per-request phase timers.
+
+Each request gets a `PhaseTimer`, and the views wrap the interesting parts
+of their work (auth, filter, count, fetch, prefetch, serialize, render, ...)
+in `self.phase(name)`. The result goes out as a standard `Server-Timing`
+header (see https://www.w3.org/TR/server-timing/), which browsers' dev
+tools show next to the request, and into the `debug` block when DEBUG is
+on. Set `IMAGO_SERVER_TIMING = False` to leave the header out.
+"""
+
+
+class PhaseTimer(object):
+    """
+    Accumulates wall clock time per named phase. A phase entered more than
+    once adds up.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = OrderedDict()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = (self.phases.get(name, 0) +
+                                 time.perf_counter() - start)
+
+    def total(self):
+        return time.perf_counter() - self.started
+
+    def as_dict(self):
+        """
+        The time spent in each phase, and in total, in seconds.
+        """
+        timings = OrderedDict(self.phases)
+        timings['total'] = self.total()
+        return timings
+
+    def header(self):
+        """
+        The timings as a `Server-Timing` header value, in milliseconds.
+        """
+        return ", ".join("%s;dur=%.2f" % (name, seconds * 1000)
+                         for name, seconds in self.as_dict().items())
+
+
+class TimingMixin(object):
+    """
+    Times every request to the view, and sets the `Server-Timing` header
+    on the response. This has to come before the restless endpoint in the
+    bases, so that it sees the response to errors too.
+    """
+
+    timer = None
+
+    def phase(self, name):
+        if self.timer is None:
+            self.timer = PhaseTimer()
+        return self.timer.phase(name)
+
+    def dispatch(self, request, *args, **kwargs):
+        self.timer = PhaseTimer()
+        response = super(TimingMixin, self).dispatch(request, *args, **kwargs)
+        if getattr(settings, 'IMAGO_SERVER_TIMING', True):
+            response['Server-Timing'] = self.timer.header()
+        return response
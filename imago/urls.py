@@ -15,6 +15,7 @@ from imago.views import (JurisdictionList,
                          OrganizationDetail,
                          DivisionDetail
                         )
+from imago.metrics import metrics
 
 urlpatterns = patterns(
     '',
@@ -25,6 +26,16 @@ urlpatterns = patterns(
     url(r'^organizations/$', OrganizationList.as_view()),
     url(r'^bills/$', BillList.as_view()),
     url(r'^divisions/$', DivisionList.as_view()),
+    url(r'^metrics/$', metrics),
+
+    # batch views (?id=<id>,<id>,...)
+    url(r'^jurisdictions/batch/$', JurisdictionDetail.as_view()),
+    url(r'^people/batch/$', PersonDetail.as_view()),
+    url(r'^votes/batch/$', VoteDetail.as_view()),
+    url(r'^events/batch/$', EventDetail.as_view()),
+    url(r'^organizations/batch/$', OrganizationDetail.as_view()),
+    url(r'^bills/batch/$', BillDetail.as_view()),
+    url(r'^divisions/batch/$', DivisionDetail.as_view()),
 
     # detail views
     url(r'^(?P<pk>ocd-jurisdiction/.+)/$', JurisdictionDetail.as_view()),
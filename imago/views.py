@@ -24,6 +24,7 @@ from .serialize import (JURISDICTION_SERIALIZE,
                         EVENT_SERIALIZE,
                         DIVISION_SERIALIZE
                        )
+from .spatial import point_filter
 from restless.http import HttpError
 
 """
@@ -36,6 +37,7 @@ The common logic for these views are in imago.helpers.*Endpoint
 class JurisdictionList(PublicListEndpoint):
     model = Jurisdiction
     serialize_config = JURISDICTION_SERIALIZE
+    max_queries = 3
     default_fields = ['id', 'name', 'url', 'classification', 'feature_flags',
                       'division.id', 'division.name']
 
@@ -60,6 +62,8 @@ class JurisdictionDetail(PublicDetailEndpoint):
 class OrganizationList(PublicListEndpoint):
     model = Organization
     serialize_config = ORGANIZATION_SERIALIZE
+    max_queries = 3
+    search_fields = ['name']
     default_fields = ['id', 'name', 'image', 'classification',
                       'jurisdiction.id', 'parent.id', 'parent.name',
                      ]
@@ -68,6 +72,7 @@ class OrganizationList(PublicListEndpoint):
 class OrganizationDetail(PublicDetailEndpoint):
     model = Organization
     serialize_config = ORGANIZATION_SERIALIZE
+    document_store = True
     default_fields = get_field_list(model, without=[
         'memberships_on_behalf_of', 'billactionrelatedentity',
         'eventrelatedentity', 'eventparticipant', 'jurisdiction_id',
@@ -101,6 +106,8 @@ class OrganizationDetail(PublicDetailEndpoint):
 class PeopleList(PublicListEndpoint):
     model = Person
     serialize_config = PERSON_SERIALIZE
+    max_queries = 7
+    search_fields = ['name', 'sort_name']
     default_fields = [
         'name', 'id', 'sort_name', 'image', 'gender',
 
@@ -119,7 +126,10 @@ class PeopleList(PublicListEndpoint):
         lat = params.pop('lat', None)
         lon = params.pop('lon', None)
         if lat and lon:
-            params['memberships__post__division__geometries__boundary__shape__contains'] = 'POINT({} {})'.format(lon, lat)
+            try:
+                params.update(point_filter(lat, lon, prefix='memberships__post__division__'))
+            except ValueError:
+                raise HttpError(400, "lat & lon must be numbers")
         elif lat or lon:
             raise HttpError(400, "must specify lat & lon together")
         return params
@@ -128,6 +138,7 @@ class PeopleList(PublicListEndpoint):
 class PersonDetail(PublicDetailEndpoint):
     model = Person
     serialize_config = PERSON_SERIALIZE
+    document_store = True
     default_fields = get_field_list(model, without=[
         'votes',
         'billactionrelatedentity',
@@ -154,6 +165,8 @@ class PersonDetail(PublicDetailEndpoint):
 class BillList(PublicListEndpoint):
     model = Bill
     serialize_config = BILL_SERIALIZE
+    max_queries = 3
+    search_fields = ['identifier', 'title']
     default_fields = [
         'id', 'identifier', 'title', 'classification', 'subject',
 
@@ -175,6 +188,7 @@ class BillList(PublicListEndpoint):
 class VoteList(PublicListEndpoint):
     model = VoteEvent
     serialize_config = VOTE_SERIALIZE
+    max_queries = 4
     default_fields = [
         'result', 'motion_text', 'created_at', 'start_date', 'updated_at',
         'motion_classification', 'extras', 'id',
@@ -217,6 +231,7 @@ class VoteDetail(PublicDetailEndpoint):
 class BillDetail(PublicDetailEndpoint):
     model = Bill
     serialize_config = BILL_SERIALIZE
+    document_store = True
     default_fields = get_field_list(model, without=[
         'from_organization_id',
         'eventrelatedentity',
@@ -270,13 +285,17 @@ class EventDetail(PublicDetailEndpoint):
 class DivisionList(PublicListEndpoint):
     model = Division
     serialize_config = DIVISION_SERIALIZE
+    max_queries = 2
     default_fields = ['id', 'name', 'country']
 
     def adjust_filters(self, params):
         lat = params.pop('lat', None)
         lon = params.pop('lon', None)
         if lat and lon:
-            params['geometries__boundary__shape__contains'] = 'POINT({} {})'.format(lon, lat)
+            try:
+                params.update(point_filter(lat, lon))
+            except ValueError:
+                raise HttpError(400, "lat & lon must be numbers")
         elif lat or lon:
             raise HttpError(400, "must specify lat & lon together")
         return params
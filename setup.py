@@ -15,6 +15,7 @@ setup(name='imago',
       entry_points={
           'console_scripts': [
               'imago-debug = imago.cli:debug',
+              'imago-load = imago.cli:load',
           ]
       },
       install_requires=[